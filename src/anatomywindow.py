@@ -69,16 +69,15 @@ class AnatomyWindow(QDialog):
 
         shape_size = 20
 
-        for z in range(int(most_ones[0][2]) - shape_size / 2, int(most_ones[0][2]) + shape_size / 2 + 1):
-            for y in range(int(most_ones[0][1]) - shape_size / 2, int(most_ones[0][1]) + shape_size / 2 + 1):
-                for x in range(int(most_ones[0][0]) - shape_size / 2, int(most_ones[0][0]) + shape_size / 2 + 1):
-                    try:
-                        new_mask[x, y ,z] = 1
-                    except IndexError:
-                        self.close()
-                        QMessageBox.warning(self, "Anatomy image error", "The mask's position is outside the bounds"
-                                                                         " of the anatomy image")
-                        return
+        # Mark a cube around the position of the ROI
+        lower = np.maximum(most_ones[0] - shape_size / 2, 0)
+        upper = most_ones[0] + shape_size / 2 + 1
+        if np.any(upper > np.array(new_mask.shape[0:3])):
+            self.close()
+            QMessageBox.warning(self, "Anatomy image error", "The mask's position is outside the bounds"
+                                                             " of the anatomy image")
+            return
+        new_mask[lower[0]:upper[0], lower[1]:upper[1], lower[2]:upper[2]] = 1
 
         masked_array = np.ma.masked_where(new_mask == 0, new_mask)
         self.img1.imshow(self.session.anatomy.sequence[:,:,most_ones[0][2]], cmap=mpl.cm.gray)
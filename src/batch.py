@@ -0,0 +1,243 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Run the calculations of a saved configuration without the user interface.
+
+The configuration is the JSON file written by the main window. Every
+project, group, individual and session which is ready for calculation gets
+a directory in the output directory with the mean and SEM of its responses
+in results.mat, and its peaks and FWHM in results.json. With an atlas,
+the mean and SEM of the responses of every ROI of the atlas are written
+to rois.mat in the directory of every session.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import scipy.io as sio
+
+from brain import Brain
+from cache import ROICache, VolumeCache
+from group import Group, make_unique, masked_statistics
+from instrumentation import profiler
+from mask import Mask
+from resultstore import save_results
+from session import Session
+from smoothing import DEFAULT_METHOD, METHODS, get_smoothing_factor
+
+
+def create_group(configuration):
+    """
+    Create a group and all of its children from a configuration, in the
+    same way as the tree items of the main window do.
+    """
+    group = Group(configuration)
+
+    for child_configuration in configuration.get('groups', []):
+        group.add_child(create_group(child_configuration))
+
+    for session_configuration in configuration.get('sessions', []):
+        group.add_session(Session(session_configuration))
+
+    return group
+
+
+def load_configuration(path):
+    """
+    Load the projects of a configuration file.
+
+    :return: A list of groups, one for every project.
+    """
+    with open(path, 'r') as f:
+        configuration = json.load(f)
+
+    return [create_group(project) for project in configuration.get('project', [])]
+
+
+def calculate(node, factor):
+    """
+    Calculate the results of a node.
+
+    :return: A tuple with a dictionary of arrays and a dictionary with
+             the peaks, FWHM and any errors that occurred.
+    """
+    mean = node.get_mean()
+    sem = node.get_sem()
+
+    arrays = {}
+    summary = {'name': node.name, 'smoothing_factor': factor,
+               'smoothing_method': node.get_smoothing_method(), 'errors': []}
+
+    for stimuli_type, data in mean.iteritems():
+        arrays['mean_' + stimuli_type] = data
+        arrays['sem_' + stimuli_type] = sem[stimuli_type]
+        arrays['x_axis'] = (np.arange(data.size) - node.baseline) * node.get_tr()
+
+    summary['peaks'] = dict((stimuli_type, [float(value) for value in position])
+                            for stimuli_type, position in node.get_peaks().iteritems())
+
+    try:
+        smooth_peaks = node.get_peaks(factor, smooth=True)
+        fwhm = node.get_fwhm('All', factor)
+    except Exception as exc:
+        summary['errors'].append(' '.join(str(arg) for arg in exc.args))
+    else:
+        summary['smooth_peaks'] = dict((stimuli_type, [float(value) for value in position])
+                                       for stimuli_type, position in smooth_peaks.iteritems())
+        summary['fwhm'] = dict((stimuli_type, [float(value) for value in position])
+                               for stimuli_type, position in fwhm.iteritems())
+
+    return arrays, summary
+
+
+def calculate_rois(session, masks):
+    """
+    Calculate the mean and SEM of the responses of every ROI of an atlas in
+    a session, with the sequence read once for all of them.
+
+    :param masks: List of Mask objects, one per ROI, see `Mask.get_labels`.
+    :return: A dictionary of arrays with the label of every ROI in labels
+             and the results of the ROIs numbered in the same order.
+    """
+    roi_responses = session.calculate_roi_responses(masks, session.get_setting('percent'),
+                                                    session.get_setting('global'))
+
+    arrays = {'labels': np.array([mask.label for mask in masks], dtype=float)}
+    for index, responses in enumerate(roi_responses):
+        for stimuli_type, data in responses.iteritems():
+            mean, sem, _, _ = masked_statistics(data)
+            arrays['mean_roi{}_{}'.format(index + 1, stimuli_type)] = mean
+            arrays['sem_roi{}_{}'.format(index + 1, stimuli_type)] = sem
+
+    return arrays
+
+
+def get_directory_name(node, index):
+    """ Return a file system safe directory name for a node. """
+    name = re.sub(r'[^\w\-. ]', '_', node.name).strip()
+    return name or str(index + 1)
+
+
+def get_directory_names(nodes):
+    """ Return a unique directory name for every node in a list of siblings. """
+    return make_unique([get_directory_name(node, index) for index, node in enumerate(nodes)])
+
+
+def write_results(node, directory, factor=None, masks=None):
+    """
+    Calculate and write the results of a node and all of its children to
+    the directory.
+
+    :param masks: ROIs of an atlas whose results are written for every
+                  session, see `calculate_rois`.
+
+    :return: A list with the summaries of the nodes that were calculated.
+    """
+    summaries = []
+
+    if node.ready_for_calculation():
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        arrays, summary = calculate(node, get_smoothing_factor(node, factor))
+        summary['directory'] = directory
+
+        sio.savemat(os.path.join(directory, 'results.mat'), arrays)
+        with open(os.path.join(directory, 'results.json'), 'w') as f:
+            json.dump(summary, f, indent=4)
+
+        summaries.append(summary)
+
+        if masks and isinstance(node, Session):
+            sio.savemat(os.path.join(directory, 'rois.mat'), calculate_rois(node, masks))
+
+    children = node.children + node.sessions
+    for child, name in zip(children, get_directory_names(children)):
+        summaries += write_results(child, os.path.join(directory, name), factor, masks)
+
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Calculate the results of a saved configuration without the user interface.')
+    parser.add_argument('configuration', help='configuration file saved by the application')
+    parser.add_argument('output', help='directory where the results are written')
+    parser.add_argument('--smoothing-factor', type=float, default=None,
+                        help='smoothing factor used for peaks and FWHM (default: the factor '
+                             'last used in the plot window for the node, otherwise the default '
+                             'of the smoothing method, for splines 2 with percent normalization '
+                             'and otherwise 20, for whittaker 10)')
+    parser.add_argument('--smoothing-method', choices=METHODS, default=None,
+                        help='method used to smooth the mean responses of every node (default: '
+                             'the method saved for the node, otherwise ' + DEFAULT_METHOD + ')')
+    parser.add_argument('--atlas', default=None,
+                        help='labelled atlas, the mean and SEM of the responses of every ROI '
+                             'in it are written to rois.mat for every session')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to aggregate the sessions of a project')
+    parser.add_argument('--cache', default=None,
+                        help='directory where extracted ROI time series are cached')
+    parser.add_argument('--volume-cache', default=None,
+                        help='directory where decompressed copies of .nii.gz files are cached')
+    parser.add_argument('--volume-cache-size', type=float, default=4096,
+                        help='maximum size of the decompressed files in MB (default: 4096)')
+    parser.add_argument('--store', default=None,
+                        help='file where the responses and results of every node are also '
+                             'written, as HDF5 if it ends with .h5 and otherwise as NPZ')
+    parser.add_argument('--profile', default=None,
+                        help='file where the time spent in every stage of the calculations '
+                             'is written as JSON')
+    args = parser.parse_args(argv)
+
+    Group.smoothing_method = args.smoothing_method
+    if args.cache:
+        Session.cache = ROICache(args.cache)
+    if args.volume_cache:
+        Brain.volume_cache = VolumeCache(args.volume_cache, int(args.volume_cache_size * 1024 ** 2))
+
+    projects = load_configuration(args.configuration)
+    masks = Mask(args.atlas).get_labels() if args.atlas else None
+
+    summaries = []
+    for project, name in zip(projects, get_directory_names(projects)):
+        project.workers = args.workers
+        summaries += write_results(project, os.path.join(args.output, name),
+                                   args.smoothing_factor, masks)
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    with open(os.path.join(args.output, 'summary.json'), 'w') as f:
+        json.dump(summaries, f, indent=4)
+
+    if args.store:
+        save_results(args.store, projects, args.smoothing_factor)
+
+    if args.profile:
+        profiler.save(args.profile)
+
+    failed = [summary for summary in summaries if summary['errors']]
+    for summary in failed:
+        sys.stderr.write(summary['directory'] + ': ' + '; '.join(summary['errors']) + '\n')
+
+    # Scheduled jobs can tell from the exit code that a node failed
+    return 1 if failed else 0
@@ -0,0 +1,274 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of the analysis pipeline on synthetic data.
+
+Synthetic EPI sequences, masks and stimuli files of a configurable size are
+written to a temporary directory, and every stage of the calculations is
+timed on them. The timings are written as JSON so that the results of
+different versions can be compared:
+
+    python -m src.benchmark results.json --shape 64 64 32 --images 200
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import nibabel as nib
+import numpy as np
+import scipy
+import scipy.io as sio
+
+from brain import Brain
+from group import Group
+from mask import Mask, create_roi
+from session import Session
+from stimuli import Stimuli
+
+
+def create_stimuli(path, images, tr, interval=20, intensities=(60, 130, 200)):
+    """
+    Write a stimuli file with a stimuli every `interval` images, cycling
+    through the intensities.
+
+    :return: The onsets of the stimuli in images.
+    """
+    onsets = np.arange(1, images - interval, interval)
+    values = np.resize(np.array(intensities), onsets.size)
+
+    # The time stamps are converted back to images with floor(time / tr)
+    times = (onsets + 0.5) * tr
+    sio.savemat(path, {'visual_stimuli': np.column_stack((times, values))})
+
+    return onsets
+
+
+def create_sequence(path, shape, images, onsets, seed=0):
+    """
+    Write an EPI sequence with noise around a constant baseline and a
+    response after every onset.
+
+    :param shape: Shape of a volume.
+    :param images: Number of images in the sequence.
+    :param onsets: Images where the responses start.
+    """
+    random = np.random.RandomState(seed)
+    data = random.normal(1000, 10, tuple(shape) + (images,)).astype(np.float32)
+
+    # Gaussian shaped response peaking 5 images after each onset
+    time_axis = np.arange(images)
+    signal = np.zeros(images)
+    for onset in onsets:
+        signal += 20 * np.exp(-((time_axis - onset - 5) / 2.0) ** 2)
+    data += signal.astype(np.float32)
+
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+
+
+def create_mask(path, shape, radius):
+    """ Write a mask with a sphere of the given radius at the center of the volume. """
+    center = [size // 2 for size in shape]
+    data = create_roi(tuple(shape), "Sphere", center, (radius,) * 3)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+
+
+def create_data(directory, shape, images, radius, tr, compressed=False):
+    """
+    Write a sequence, mask and stimuli file to the directory.
+
+    :return: A tuple with the paths of the sequence, mask and stimuli.
+    """
+    extension = '.nii.gz' if compressed else '.nii'
+    brain_path = os.path.join(directory, 'brain' + extension)
+    mask_path = os.path.join(directory, 'mask' + extension)
+    stimuli_path = os.path.join(directory, 'stimuli.mat')
+
+    onsets = create_stimuli(stimuli_path, images, tr)
+    create_sequence(brain_path, shape, images, onsets)
+    create_mask(mask_path, shape, radius)
+
+    return brain_path, mask_path, stimuli_path
+
+
+def measure(function, repeat, setup=None):
+    """
+    Time a function.
+
+    :param function: Function to time, called without arguments.
+    :param repeat: Number of times the function is timed.
+    :param setup: Function called before every call to `function`, which
+                  is not included in the time.
+    :return: A dictionary with the best and mean time in seconds.
+    """
+    times = []
+    for _ in xrange(repeat):
+        if setup:
+            setup()
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+
+    return {'best': min(times), 'mean': sum(times) / len(times), 'repeat': repeat}
+
+
+def run(brain_path, mask_path, stimuli_path, tr, sessions, repeat, factor):
+    """
+    Time every stage of the calculations on the given files.
+
+    :param sessions: Number of sessions in the group used for the group
+                     statistics, all using the same files.
+    :return: A dictionary with the name of each stage as keys and the
+             timings from `measure` as values.
+    """
+    results = {}
+
+    def load_brain():
+        Brain(brain_path, mmap=False).sequence
+    results['brain_load'] = measure(load_brain, repeat)
+
+    session = Session()
+    session.brain = Brain(brain_path)
+    mask = Mask(mask_path)
+    stimuli = Stimuli(stimuli_path)
+    stimuli.tr = tr
+
+    results['apply_mask'] = measure(lambda: session.apply_mask(mask), repeat)
+    results['separate_into_responses'] = measure(lambda: session.separate_into_responses(stimuli),
+                                                 repeat)
+
+    separate = lambda: session.separate_into_responses(stimuli)
+    results['normalize'] = measure(lambda: session.normalize(True, False), repeat, separate)
+    results['normalize_global'] = measure(lambda: session.normalize(True, True), repeat, separate)
+
+    group = Group()
+    group.tr = tr
+    for index in xrange(sessions):
+        child = Session()
+        child.name = 'session' + str(index)
+        child.tr = tr
+        child.load_sequence(brain_path)
+        child.load_mask(mask_path)
+        child.load_stimuli(stimuli_path)
+        group.add_session(child)
+
+    def clear_responses():
+        group.responses = {}
+        for child in group.sessions:
+            child.responses = {}
+    results['group_aggregate'] = measure(lambda: group.aggregate(False, False, None, None), repeat,
+                                         clear_responses)
+
+    # The statistics are cached in the blocks of the group and its children
+    def clear_blocks():
+        group.block = None
+        group.child_blocks = None
+        for child in group.sessions:
+            child.block = None
+    group.aggregate(False, False, None, None)
+    results['calculate_mean'] = measure(lambda: group.calculate_mean(False, False, None, None),
+                                        repeat, clear_blocks)
+    results['calculate_sem'] = measure(lambda: group.calculate_sem(False, False), repeat,
+                                       clear_blocks)
+
+    def clear_smooth():
+        group.smoothed_responses = None
+        group.peaks = None
+    results['get_smooth'] = measure(lambda: group.get_smooth(factor), repeat, clear_smooth)
+    results['get_fwhm'] = measure(lambda: group.get_fwhm('All', factor), repeat, clear_smooth)
+
+    group.smoothing_method = 'whittaker'
+    results['get_smooth_whittaker'] = measure(lambda: group.get_smooth(factor), repeat, clear_smooth)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time the analysis pipeline on synthetic data and write the results as JSON.')
+    parser.add_argument('output', help='file where the results are written')
+    parser.add_argument('--shape', type=int, nargs=3, default=[64, 64, 32],
+                        help='shape of a volume (default: 64 64 32)')
+    parser.add_argument('--images', type=int, default=200,
+                        help='number of images in the sequence (default: 200)')
+    parser.add_argument('--radius', type=float, default=8,
+                        help='radius of the spherical ROI in voxels (default: 8)')
+    parser.add_argument('--tr', type=float, default=0.5, help='tr of the sequence (default: 0.5)')
+    parser.add_argument('--sessions', type=int, default=4,
+                        help='number of sessions used for the group statistics (default: 4)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times every stage is timed (default: 3)')
+    parser.add_argument('--smoothing-factor', type=float, default=20,
+                        help='smoothing factor used for smoothing and FWHM (default: 20)')
+    parser.add_argument('--compressed', action='store_true',
+                        help='write the sequence and mask as .nii.gz')
+    parser.add_argument('--data', default=None,
+                        help='directory where the synthetic data is written and kept '
+                             '(default: a temporary directory which is removed)')
+    args = parser.parse_args(argv)
+
+    directory = args.data or tempfile.mkdtemp(prefix='jabe-benchmark-')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    try:
+        paths = create_data(directory, args.shape, args.images, args.radius, args.tr,
+                            args.compressed)
+        results = run(paths[0], paths[1], paths[2], args.tr, args.sessions, args.repeat,
+                      args.smoothing_factor)
+    finally:
+        if not args.data:
+            shutil.rmtree(directory)
+
+    report = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'nibabel': nib.__version__,
+        'parameters': {
+            'shape': args.shape,
+            'images': args.images,
+            'radius': args.radius,
+            'tr': args.tr,
+            'sessions': args.sessions,
+            'repeat': args.repeat,
+            'smoothing_factor': args.smoothing_factor,
+            'compressed': args.compressed
+        },
+        'results': results
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+
+    for name in sorted(results):
+        sys.stdout.write('%-26s %10.4f s\n' % (name, results[name]['best']))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
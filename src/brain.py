@@ -16,6 +16,9 @@
 # along with JABE.  If not, see <http://www.gnu.org/licenses/>.
 
 import nibabel
+import numpy as np
+
+from instrumentation import profiler
 
 
 class Brain:
@@ -24,18 +27,128 @@ class Brain:
 
     Currently only supports NIfTI1. The data is accessible via the member
     `data`.
+
+    The image is memory-mapped by default, which means that only the parts
+    of the file that are read through `get_volume` or `get_block` are
+    loaded into memory. `sequence` still returns the complete image.
+
+    If `Brain.volume_cache` is set compressed images are opened from their
+    decompressed copies in the cache, see `cache.VolumeCache`. Otherwise
+    the file of a compressed image is kept open, so that volumes read one
+    after another continue the decompression instead of starting it over
+    from the beginning of the file.
     """
-    def __init__(self, path):
+
+    # VolumeCache shared by all images, compressed images are read directly if None
+    volume_cache = None
+
+    # Number of bytes of volumes read at once by get_global_mean
+    slab_size = 64 * 1024 ** 2
+
+    def __init__(self, path, mmap=True):
         """
         :param path: The file path to the brain image/sequence.
+        :param mmap: Whether the image data should be memory-mapped instead
+                     of read into memory when accessed.
         """
         self.path = path
-        self.brain_file = nibabel.load(path)
+        self.mmap = mmap
+        with profiler.span('brain_load'):
+            load_path = self.volume_cache.get(path) if self.volume_cache else path
+            if load_path.endswith('.gz'):
+                self.brain_file = nibabel.load(load_path, keep_file_open=True)
+            elif mmap:
+                self.brain_file = nibabel.load(load_path)
+            else:
+                self.brain_file = nibabel.load(load_path, mmap=False)
+
+        self.global_mean = None
+        self.global_samples = None
 
     def get_voxel_size(self):
         """ Returns the size of one voxel in the image. """
         return self.brain_file._header.get_zooms()
 
+    def get_volume(self, index):
+        """
+        Read a single volume from the sequence without loading the rest of
+        the image.
+
+        :param index: Index of the volume along the time axis.
+        :return: 3D array with the volume data.
+        """
+        volume = np.asanyarray(self.brain_file.dataobj[..., index])
+        profiler.add_bytes_read(volume.nbytes)
+        return volume
+
+    def get_volumes(self, start, stop):
+        """
+        Read consecutive volumes from the sequence without loading the rest
+        of the image.
+
+        :param start: Index of the first volume along the time axis.
+        :param stop: Index after the last volume.
+        :return: 4D array with the volumes.
+        """
+        volumes = np.asanyarray(self.brain_file.dataobj[..., start:stop])
+        profiler.add_bytes_read(volumes.nbytes)
+        return volumes
+
+    def get_block(self, x, y, z, images=slice(None)):
+        """
+        Read a block of voxels over time without loading the rest of the
+        image.
+
+        :param x: Slice along the first axis.
+        :param y: Slice along the second axis.
+        :param z: Slice along the third axis.
+        :param images: Slice along the time axis, all images by default.
+        :return: 4D array with the data of the block.
+        """
+        with profiler.span('read_sequence'):
+            block = np.asanyarray(self.brain_file.dataobj[x, y, z, images])
+            profiler.add_bytes_read(block.nbytes)
+        return block
+
+    def get_slab_images(self, voxels):
+        """
+        :param voxels: Number of voxels in every image that is read.
+        :return: The number of images that fit in `slab_size` bytes, at
+                 least one.
+        """
+        size = voxels * self.brain_file.get_data_dtype().itemsize
+        return max(1, self.slab_size // max(1, size))
+
+    def get_global_mean(self):
+        """
+        Return the mean of all non-zero samples in the sequence.
+
+        The sum and the number of non-zero samples are accumulated over
+        slabs of consecutive volumes of at most `slab_size` bytes, read in
+        the order they are stored, so the sequence is never loaded as a
+        whole and a compressed file is decompressed only once. The result
+        is cached in the members `global_mean` and `global_samples`.
+        """
+        if self.global_mean is None:
+            with profiler.span('global_mean'):
+                step = self.get_slab_images(int(np.prod(self.shape[0:3])))
+
+                total = 0.0
+                samples = 0
+                for start in xrange(0, self.images, step):
+                    slab = self.get_volumes(start, min(start + step, self.images))
+                    total += np.sum(slab, dtype=np.float64)
+                    samples += np.count_nonzero(slab)
+
+                self.global_samples = samples
+                self.global_mean = total / samples
+
+        return self.global_mean
+
+    def uncache(self):
+        """ Release image data that has been read into memory. """
+        self.brain_file.uncache()
+
     @property
     def shape(self):
         return self.brain_file.shape
@@ -0,0 +1,263 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Export of the results of every node in one or more projects.
+
+The tree is walked once and the results of every node which is ready for
+calculation are calculated, reusing the responses and statistics that
+the nodes have cached. The files are then written in a pool of threads,
+one directory per node, together with manifest.json in the output
+directory which lists the nodes, their files, peaks, FWHM and latencies:
+
+    python -m src.bulkexport configuration.json results/ --format csv
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import scipy.io as sio
+
+from batch import get_directory_names, load_configuration
+from resultstore import get_node_results
+
+# File formats the results can be exported as
+FORMATS = ['mat', 'txt', 'csv', 'npz']
+
+
+class ExportCancelled(Exception):
+    """ Raised by a progress callback to stop an export. """
+    pass
+
+
+def get_stimuli_types(arrays, kind='mean'):
+    """ Return the stimuli values of a kind of results, sorted by value. """
+    prefix = kind + '/'
+    return sorted([name[len(prefix):] for name in arrays if name.startswith(prefix)], key=float)
+
+
+def count_nodes(node):
+    """ Return the number of nodes below and including a node that are ready for calculation. """
+    return int(node.ready_for_calculation()) + \
+        sum(count_nodes(child) for child in node.children + node.sessions)
+
+
+def collect_nodes(node, directory, tree_path, factor=None, progress=None):
+    """
+    Calculate the results of a node and all of its children.
+
+    :param directory: Directory the results of the node are written to.
+    :param tree_path: Names of the node and its parents separated by '/'.
+    :param factor: Smoothing factor used for the smoothed peaks and FWHM.
+    :param progress: Function called with the path of every node after it
+                     has been calculated.
+    :return: A list with a dictionary for every node that is ready for
+             calculation, with its directory, path in the tree, arrays and
+             attributes, see `resultstore.get_node_results`.
+    """
+    entries = []
+
+    if node.ready_for_calculation():
+        arrays, attributes = get_node_results(node, factor)
+        entries.append({'directory': directory, 'path': tree_path,
+                        'arrays': arrays, 'attributes': attributes})
+        if progress:
+            progress(tree_path)
+
+    children = node.children + node.sessions
+    for child, name in zip(children, get_directory_names(children)):
+        entries += collect_nodes(child, os.path.join(directory, name), tree_path + '/' + name,
+                                 factor, progress)
+
+    return entries
+
+
+def write_mat(directory, arrays):
+    sio.savemat(os.path.join(directory, 'results.mat'),
+                dict((name.replace('/', '_'), array) for name, array in arrays.iteritems()))
+    return ['results.mat']
+
+
+def write_npz(directory, arrays):
+    with open(os.path.join(directory, 'results.npz'), 'wb') as f:
+        np.savez_compressed(f, **dict((name.replace('/', '_'), array)
+                                      for name, array in arrays.iteritems()))
+    return ['results.npz']
+
+
+def write_txt(directory, arrays):
+    """
+    Write the mean and SEM in the same layout as the export window, with
+    one row per stimuli value starting with the value.
+    """
+    files = []
+    for kind in ['mean', 'sem']:
+        rows = [np.concatenate(([float(stimuli_type)], arrays[kind + '/' + stimuli_type]))
+                for stimuli_type in get_stimuli_types(arrays, kind)]
+        if rows:
+            np.savetxt(os.path.join(directory, kind + '.txt'), np.vstack(rows), '%.10g')
+            files.append(kind + '.txt')
+    return files
+
+
+def write_csv(directory, arrays):
+    """ Write a table with the time and the mean and SEM of every stimuli value as columns. """
+    if 'x_axis' not in arrays:
+        return []
+
+    columns = [arrays['x_axis']]
+    header = ['time']
+    for stimuli_type in get_stimuli_types(arrays):
+        for kind in ['mean', 'sem']:
+            columns.append(arrays[kind + '/' + stimuli_type])
+            header.append(kind + '_' + stimuli_type)
+
+    np.savetxt(os.path.join(directory, 'results.csv'), np.column_stack(columns), '%.10g',
+               delimiter=',', header=','.join(header), comments='')
+    return ['results.csv']
+
+
+WRITERS = {'mat': write_mat, 'npz': write_npz, 'txt': write_txt, 'csv': write_csv}
+
+
+def write_node(entry, format_):
+    """
+    Write the results of a node from `collect_nodes` to its directory,
+    which has to exist.
+
+    :return: A list with the names of the files that were written.
+    """
+    return WRITERS[format_](entry['directory'], entry['arrays'])
+
+
+def get_manifest_entry(entry, files, directory):
+    """ Return the description of an exported node in the manifest. """
+    arrays = entry['arrays']
+    manifest_entry = dict(entry['attributes'])
+    manifest_entry.update({
+        'path': entry['path'],
+        'directory': os.path.relpath(entry['directory'], directory),
+        'files': files,
+        'stimuli': get_stimuli_types(arrays)
+    })
+
+    for kind in ['peaks', 'smooth_peaks', 'fwhm', 'amplitude', 'onset_latency', 'time_to_peak']:
+        manifest_entry[kind] = dict((stimuli_type, arrays[kind + '/' + stimuli_type].tolist())
+                                    for stimuli_type in get_stimuli_types(arrays, kind))
+
+    return manifest_entry
+
+
+def export_projects(projects, directory, format_='mat', factor=None, threads=4, progress=None):
+    """
+    Export the results of every node in the projects to a directory.
+
+    :param projects: List of groups, one for every project.
+    :param directory: Output directory, every node gets a directory in it
+                      following the tree of the projects.
+    :param format_: One of `FORMATS`.
+    :param factor: Smoothing factor, by default the one of the plot window.
+    :param threads: Number of threads the files are written in.
+    :param progress: Function called with the number of nodes calculated,
+                     the number of nodes to calculate and the path of the
+                     node that was calculated last. It can raise
+                     `ExportCancelled` to stop the export.
+    :return: The manifest, which is also written to manifest.json.
+    """
+    if format_ not in WRITERS:
+        raise ValueError("Unknown format " + str(format_))
+
+    total = sum(count_nodes(project) for project in projects)
+    done = [0]
+
+    def node_progress(path):
+        done[0] += 1
+        if progress:
+            progress(done[0], total, path)
+
+    entries = []
+    for project, name in zip(projects, get_directory_names(projects)):
+        entries += collect_nodes(project, os.path.join(directory, name), name, factor,
+                                 node_progress)
+
+    # The directories share parents, so they are created before the
+    # threads write to them
+    for path in [directory] + [entry['directory'] for entry in entries]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    if entries:
+        pool = ThreadPool(min(threads, len(entries)))
+        try:
+            files = pool.map(lambda entry: write_node(entry, format_), entries)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        files = []
+
+    manifest = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'format': format_,
+        'nodes': [get_manifest_entry(entry, node_files, directory)
+                  for entry, node_files in zip(entries, files)]
+    }
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export the results of every node in a saved configuration.')
+    parser.add_argument('configuration', help='configuration file saved by the application')
+    parser.add_argument('output', help='directory where the results are written')
+    parser.add_argument('--format', choices=FORMATS, default='mat',
+                        help='file format of the results (default: mat)')
+    parser.add_argument('--smoothing-factor', type=float, default=None,
+                        help='smoothing factor used for peaks and FWHM (default: the factor '
+                             'last used in the plot window for each node, otherwise the default '
+                             'of its smoothing method)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to aggregate the sessions of a project')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='number of threads the files are written in (default: 4)')
+    args = parser.parse_args(argv)
+
+    projects = load_configuration(args.configuration)
+    for project in projects:
+        project.workers = args.workers
+
+    manifest = export_projects(projects, args.output, args.format, args.smoothing_factor,
+                               args.threads)
+
+    failed = [node for node in manifest['nodes'] if node['errors']]
+    for node in failed:
+        sys.stderr.write(node['directory'] + ': ' + '; '.join(node['errors']) + '\n')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class DiskCache(object):
+    """
+    Directory of cached files with a bounded total size.
+
+    The modification time of a file is used as its last access time, and
+    the least recently used files are removed when the size of the
+    directory grows above the limit.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        :param directory: Directory where the cached files are stored.
+        :param max_size: Maximum total size of the cached files in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_path(self, key, extension=''):
+        return os.path.join(self.directory, key + extension)
+
+    def touch(self, path):
+        """ Mark the cached file as recently used. """
+        os.utime(path, None)
+
+    def temporary_path(self, extension=''):
+        """
+        Return a path in the cache directory which can be written to and
+        then moved in place with `os.rename`, so that other processes never
+        see partially written files.
+        """
+        handle, path = tempfile.mkstemp(suffix=extension + '.tmp', dir=self.directory)
+        os.close(handle)
+        return path
+
+    def replace(self, temp_path, path):
+        """ Move a file written to a temporary path in place. """
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Renaming onto an existing file fails on Windows
+            os.remove(path)
+            os.rename(temp_path, path)
+
+    def entries(self):
+        """ Return a list of (path, size, last access) for every cached file. """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self, keep=()):
+        """
+        Remove the least recently used files until the cache fits within
+        `max_size`.
+
+        :param keep: Paths which should not be removed.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+
+        for path, file_size, _ in entries:
+            if size <= self.max_size:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+                size -= file_size
+            except OSError:
+                pass
+
+
+class ROICache(DiskCache):
+    """
+    Content addressed cache of ROI time series.
+
+    The masked data of a session is stored under the hashes of the content
+    of the EPI sequence and the mask, so that it stays valid when files are
+    moved and is invalidated as soon as either file changes. The hashes
+    are remembered by path, size and modification time so that a file is
+    only read once.
+    """
+
+    _index_name = 'hashes.json'
+
+    def __init__(self, directory, max_size=256 * 1024 ** 2):
+        super(ROICache, self).__init__(directory, max_size)
+        self.index_path = self.get_path(self._index_name)
+        self.hashes = {}
+
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.hashes = json.load(f)
+            except ValueError:
+                self.hashes = {}
+
+    def file_hash(self, path):
+        """ Return the SHA-1 hash of the content of the file at the path. """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime]
+
+        if path in self.hashes and self.hashes[path][0:2] == stamp:
+            return self.hashes[path][2]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(chunk)
+
+        self.hashes[path] = stamp + [digest.hexdigest()]
+        self.save_index()
+        return self.hashes[path][2]
+
+    def save_index(self):
+        temp_path = self.temporary_path('.json')
+        with open(temp_path, 'w') as f:
+            json.dump(self.hashes, f)
+        self.replace(temp_path, self.index_path)
+
+    def get_key(self, brain_path, mask_path):
+        return self.file_hash(brain_path) + '_' + self.file_hash(mask_path)
+
+    def load(self, brain_path, mask_path):
+        """
+        Return the cached masked data for the sequence and mask, or None if
+        it has not been cached.
+        """
+        path = self.get_path(self.get_key(brain_path, mask_path), '.npy')
+
+        try:
+            masked_data = np.load(path)
+        except (IOError, ValueError):
+            return None
+
+        self.touch(path)
+        return masked_data
+
+    def store(self, brain_path, mask_path, masked_data):
+        """ Save the masked data for the sequence and mask in the cache. """
+        path = self.get_path(self.get_key(brain_path, mask_path), '.npy')
+        temp_path = self.temporary_path('.npy')
+
+        with open(temp_path, 'wb') as f:
+            np.save(f, masked_data)
+        self.replace(temp_path, path)
+
+        self.evict(keep=(path, self.index_path))
+
+
+class VolumeCache(DiskCache):
+    """
+    Cache of decompressed images.
+
+    Compressed NIfTI files (.nii.gz) have to be decompressed every time
+    they are read, and cannot be memory-mapped. The cache keeps an
+    uncompressed copy of every compressed file that has been opened, keyed
+    by its path, size and modification time, so that it is decompressed
+    once and then memory-mapped like any .nii file.
+    """
+
+    def __init__(self, directory, max_size=4 * 1024 ** 3):
+        super(VolumeCache, self).__init__(directory, max_size)
+
+    @staticmethod
+    def is_compressed(path):
+        return path.endswith('.gz')
+
+    def get_key(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = json.dumps([path, stat.st_size, stat.st_mtime])
+        return hashlib.sha1(stamp.encode('utf-8')).hexdigest()
+
+    def get(self, path):
+        """
+        Return the path of an uncompressed copy of a compressed image,
+        decompressing it into the cache if it is not there. Other paths are
+        returned as they are.
+
+        :param path: Path to an image.
+        :return: Path to the image that should be opened instead.
+        """
+        if not self.is_compressed(path):
+            return path
+
+        cached_path = self.get_path(self.get_key(path), '.nii')
+        if os.path.exists(cached_path):
+            self.touch(cached_path)
+            return cached_path
+
+        temp_path = self.temporary_path('.nii')
+        with gzip.open(path, 'rb') as source, open(temp_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 ** 2)
+        self.replace(temp_path, cached_path)
+
+        self.evict(keep=(cached_path,))
+        return cached_path
@@ -0,0 +1,96 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from instrumentation import profiler
+from smoothing import get_smoothing_factor
+
+
+class CalculationThread(QThread):
+    """
+    Thread which calculates the results of a project, group, individual or
+    session before it is plotted.
+
+    Every session is aggregated on its own so that progress can be reported
+    and the calculation can be cancelled between sessions. When all sessions
+    are done the mean, SEM, peaks and FWHM of the node are calculated, which
+    are then cached in the node when the plot window asks for them.
+    """
+
+    # Number of sessions done, number of sessions and name of the last session
+    progress = pyqtSignal(int, int, str)
+    # Emitted when every result has been calculated
+    calculated = pyqtSignal()
+    # Emitted with an error message if the calculation failed
+    failed = pyqtSignal(str)
+
+    def __init__(self, node, parent=None):
+        """
+        :param node: Group or session to calculate the results of.
+        :param parent: Parent object of the thread.
+        """
+        super(CalculationThread, self).__init__(parent)
+        self.node = node
+        self.cancelled = False
+
+    def cancel(self):
+        """ Stop the calculation after the session currently aggregated. """
+        self.cancelled = True
+
+    def run(self):
+        # The timing report shows the latest calculation
+        profiler.clear()
+
+        try:
+            self.calculate()
+        except Exception as exc:
+            self.failed.emit(' '.join(str(arg) for arg in exc.args))
+
+    def calculate(self):
+        percentage = self.node.get_setting('percent')
+        global_ = self.node.get_setting('global')
+        mask = self.node.get_mask()
+        stimuli = self.node.get_stimuli()
+
+        if self.node.workers > 1:
+            self.node.aggregate_sessions(percentage, global_, mask, stimuli)
+
+        sessions = self.node.get_sessions(mask, stimuli)
+        for index, (session, session_mask, session_stimuli) in enumerate(sessions):
+            if self.cancelled:
+                return
+            session.aggregate(percentage, global_, session_mask, session_stimuli)
+            self.progress.emit(index + 1, len(sessions), session.name)
+
+        if self.cancelled:
+            return
+
+        self.node.get_mean()
+        self.node.get_sem()
+        self.node.get_peaks()
+
+        # The plot window starts with the same factor, smoothing errors are
+        # shown by it
+        factor = get_smoothing_factor(self.node)
+        try:
+            self.node.get_peaks(factor, smooth=True)
+            self.node.get_fwhm('All', factor)
+        except Exception:
+            pass
+
+        self.calculated.emit()
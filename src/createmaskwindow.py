@@ -124,8 +124,8 @@ class CreateMaskWindow(QDialog):
                             return
                         path = file_name[0]+file_name[1]
                         shape = self.ui.comboBox_shape.currentText()
-                        width = voxel_width
-                        Mask(path, shape, coordinate, width, self.brain_file)
+                        width = (float(width),) * 3
+                        Mask(path, shape, coordinate, width, self.brain_file, millimetres=True)
                         self.close()
                         self.parent().load_mask(path)
                     else:
@@ -0,0 +1,68 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from bulkexport import ExportCancelled, export_projects
+
+
+class ExportThread(QThread):
+    """
+    Thread which calculates and exports the results of every node in the
+    projects, see `bulkexport.export_projects`.
+    """
+
+    # Number of nodes done, number of nodes and path of the last node
+    progress = pyqtSignal(int, int, str)
+    # Emitted with the number of exported nodes when done
+    exported = pyqtSignal(int)
+    # Emitted with an error message if the export failed
+    failed = pyqtSignal(str)
+
+    def __init__(self, projects, directory, format_, parent=None):
+        """
+        :param projects: List of groups, one for every project.
+        :param directory: Directory the results are written to.
+        :param format_: File format, one of `bulkexport.FORMATS`.
+        :param parent: Parent object of the thread.
+        """
+        super(ExportThread, self).__init__(parent)
+        self.projects = projects
+        self.directory = directory
+        self.format = format_
+        self.cancelled = False
+
+    def cancel(self):
+        """ Stop the export before the next node is calculated. """
+        self.cancelled = True
+
+    def report_progress(self, done, total, path):
+        if self.cancelled:
+            raise ExportCancelled()
+        self.progress.emit(done, total, path)
+
+    def run(self):
+        try:
+            manifest = export_projects(self.projects, self.directory, self.format,
+                                       progress=self.report_progress)
+        except ExportCancelled:
+            return
+        except Exception as exc:
+            self.failed.emit(' '.join(str(arg) for arg in exc.args))
+            return
+
+        self.exported.emit(len(manifest['nodes']))
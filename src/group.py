@@ -15,14 +15,40 @@
 # You should have received a copy of the GNU General Public License
 # along with JABE.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
+
 import numpy as np
-from scipy.interpolate import UnivariateSpline
-from scipy.stats import sem
 
 from src.brain import Brain
 from src.stimuli import Stimuli
 from src.mask import Mask
-import session
+from headers import read_header
+from instrumentation import profiler
+import peakanalysis
+import smoothing
+
+
+def lazy_file(name):
+    """
+    Create a property for a file of a group which is opened the first time
+    it is used, see `Group.defer_loading`.
+
+    :param name: Name of the file, such as 'mask' or 'stimuli'.
+    """
+    attribute = '_' + name
+
+    def get(self):
+        if name in self.pending:
+            self.load_pending(name)
+        return getattr(self, attribute)
+
+    def set(self, value):
+        # Setting a file replaces the one waiting to be opened
+        self.pending.pop(name, None)
+        self.unopened.pop(name, None)
+        setattr(self, attribute, value)
+
+    return property(get, set)
 
 
 class Group(object):
@@ -30,11 +56,26 @@ class Group(object):
     Class containing methods for analysing a group of groups and
     groups of sessions recursively.
     """
+
+    mask = lazy_file('mask')
+    stimuli = lazy_file('stimuli')
+    anatomy = lazy_file('anatomy')
+
+    # Method used to smooth the mean responses of every node, see
+    # smoothing.METHODS. If None the method of each node is used, see
+    # get_smoothing_method
+    smoothing_method = None
+
     def __init__(self, configuration=None):
         self.name = ""
         self.description = ""
         self.plot_settings = {}
 
+        # Configurations of the files that are opened when first used
+        self.pending = {}
+        # Configurations of deferred files that could not be opened, which
+        # are kept so that they are saved with the configuration
+        self.unopened = {}
         self.mask = None
         self.stimuli = None
         self.anatomy = None
@@ -43,24 +84,58 @@ class Group(object):
         self.children = []
         # TODO: Remove this
         self.sessions = []
-
-        # Result of calculations are kept here
+        # Group the node has been added to, see get_tree_path
+        self.parent_group = None
+
+        # Result of calculations are kept here. A group keeps the responses
+        # of the sessions below it in response_parts and only concatenates
+        # them when they are read, see the responses property
+        self.response_parts = []
+        self.response_width = 0
         self.responses = {}
         self.mean_responses = {}
         self.sem_responses = {}
+        self.std_responses = {}
+        self.count_responses = {}
+        # Smoothed samples of the mean responses, and the splines through
+        # them which are only created when they are needed
         self.smoothed_responses = None
+        self.splines = None
         self.smoothing_factor = None
+        self.smoothed_method = None
         self.x_axis = None
+        # Number of images before the onsets in the responses
+        self.baseline = 0
+        # Peaks, latencies and FWHM of the smoothed responses, see
+        # get_response_properties
         self.peaks = None
+        self.response_properties = None
+
+        # Incremented every time the responses are calculated, so that the
+        # parent can tell which children changed since it aggregated them
+        self.version = 0
+        # Statistics of the responses, see get_block
+        self.block = None
+        # Id and version of every child in the last aggregation
+        self.child_versions = None
+        # Version, offset and block of every child merged into the block,
+        # and the baseline and width the blocks were merged with
+        self.child_blocks = None
+        self.block_alignment = None
+
+        # Number of processes used when aggregating the sessions below the
+        # group, 1 means that everything is calculated in this process.
+        self.workers = 1
 
         if configuration:
             self.load_configuration(configuration)
 
     def ready_for_calculation(self, mask=None, stimuli=None):
+        # Only check that the files can be opened, they are opened when calculated
         if not stimuli:
-            stimuli = self.get_stimuli()
+            stimuli = self.uses_file('stimuli')
         if not mask:
-            mask = self.get_mask()
+            mask = self.uses_file('mask')
 
         children = self.children + self.sessions
 
@@ -77,6 +152,8 @@ class Group(object):
         the smoothed response with the stimuli value is at half its maximum value.
         The min value used is the value on the y axis when x equals 0.
         The max values is the position returend by self.get_peak.
+        A position is NaN if the response does not cross half its maximum
+        value on that side of the peak.
         Raises Exception if no peak exists in the span or if not enough data points are
         avaliable for smoothing.
 
@@ -85,36 +162,28 @@ class Group(object):
         :param factor: smoothing factor used for calculating fwhm.
         :return: Dictionary with stimuli values as keys and tuples with two floats as value
         """
-
-        if not self.smoothed_responses:
-            self.get_smooth(factor, splice=True)
-        peaks = self.get_peaks(factor, smooth=True)
-
-        def calculate_fwhm(stimuli):
-            """
-            Returns a tuple with positions on the x axis
-            Assumes that stimuli exists in self.smooth_responses
-            """
-            top = peaks[stimuli][1]
-            low = float(self.smoothed_responses[stimuli](0))
-            half_max = (top - low)/2
-            y = self.mean_responses[stimuli]
-            spline = UnivariateSpline(self.x_axis, y - half_max - low, s=factor)
-            roots = spline.roots()
-            if np.any(roots):
-                for i in range(1, len(roots)):
-                    if roots[i] > peaks[stimuli][0]:
-                        break
-                roots = (roots[i - 1], roots[i])
-            return roots
+        properties = self.get_response_properties(factor)
 
         if stimuli == "All":
-            res = {}
-            for stimuli in self.smoothed_responses.keys():
-                res[stimuli] = calculate_fwhm(stimuli)
-            return res
+            return dict((stimuli, properties[stimuli]['fwhm']) for stimuli in properties)
         else:
-            return {stimuli: calculate_fwhm(stimuli)}
+            return {stimuli: properties[stimuli]['fwhm']}
+
+    def get_response_properties(self, factor):
+        """
+        Return the peak, amplitude, latencies and FWHM of every smoothed
+        response, see `peakanalysis.analyze_curves`. They are calculated
+        once per smoothing factor.
+
+        Raises an exception if a curve has no peak.
+
+        :param factor: Smoothing factor used.
+        :return: A dictionary with stimuli values as keys and dictionaries
+                 with 'peak', 'amplitude', 'onset_latency', 'time_to_peak'
+                 and 'fwhm' as keys as values.
+        """
+        self.get_peaks(factor, smooth=True)
+        return self.response_properties
 
     def get_peaks(self, factor=0, smooth=False):
         """
@@ -129,92 +198,237 @@ class Group(object):
             peaks = {}
             for stimuli_val, curve in self.mean_responses.iteritems():
                 max = np.argmax(curve)
-                pos = max * self.get_tr(), curve[max]
+                pos = (max - self.baseline) * self.get_tr(), curve[max]
                 peaks[stimuli_val] = pos
             return peaks
 
-        if factor != self.smoothing_factor:
-            self.get_smooth(factor, splice=False)
+        # Calculates the smoothed curves again if they have changed, which
+        # resets the peaks
+        self.get_smooth(factor)
 
-        if self.peaks:
+        if self.peaks is not None:
             return self.peaks
         self.calculate_smooth_peaks()
         return self.peaks
 
     def calculate_smooth_peaks(self):
         """
-        Calculate peaks of every curve in self.smoothed_responses and 
-        stores them in self.peaks
+        Calculate the peaks, latencies and FWHM of every smoothed curve at
+        once and store them in self.peaks and self.response_properties.
 
         Raises an exception if a curve has no peak.
         """
+        smoothed = self.get_smooth(self.smoothing_factor)
+        stimuli_values = list(smoothed.keys())
+
+        self.peaks = None
+        self.response_properties = {}
+        if not stimuli_values:
+            self.peaks = {}
+            return
+
+        with profiler.span('peaks', self.get_tree_path()):
+            analysis = peakanalysis.analyze_curves(
+                self.x_axis, np.vstack([smoothed[stimuli_val] for stimuli_val in stimuli_values]))
 
-        def calc_smooth_peak(curve):
-            """
-            Calculate the peak of given curve>
-            Raises an exception if the curve has no peak.
-            """
-            roots = curve.derivative().roots()
-            valid_roots = filter(
-                    lambda x: x > self.x_axis[0] and x < self.x_axis[-1], roots)
-            if valid_roots < 1:
-                raise Exception
-            top_root = valid_roots[np.argmax(curve(valid_roots))]
-            return top_root, float(curve(top_root))
-
-        self.peaks = {}
-
-        for stimuli_val, curve in self.smoothed_responses.iteritems():
-            try:
-                self.peaks[stimuli_val] = calc_smooth_peak(curve)
-            except Exception:
+        for row, stimuli_val in enumerate(stimuli_values):
+            if not analysis['valid'][row]:
                 raise Exception("Peak error", str(stimuli_val) + " has no valid peak")
 
-    def load_anatomy(self, path):
+            self.response_properties[stimuli_val] = {
+                'peak': (float(analysis['peak_time'][row]), float(analysis['peak_value'][row])),
+                'amplitude': float(analysis['amplitude'][row]),
+                'onset_latency': float(analysis['onset_latency'][row]),
+                'time_to_peak': float(analysis['time_to_peak'][row]),
+                'fwhm': (float(analysis['fwhm_start'][row]), float(analysis['fwhm_end'][row]))
+            }
+
+        self.peaks = dict((stimuli_val, properties['peak'])
+                          for stimuli_val, properties in self.response_properties.iteritems())
+
+    def check_anatomy(self, path):
+        """ Check an anatomy by its header. Returns an error message if it can not be opened, otherwise None """
         try:
-            temp_anatomy = Brain(path)
+            header = read_header(path)
         except IOError:
             return path + " does not exist"
         except:
             return path + " could not be opened. It might be corrupted"
-        if len(temp_anatomy.shape) != 3:
-            return "The data has " + str(len(temp_anatomy.shape)) + " dimensions instead of 3"
-        else:
-            self.anatomy = temp_anatomy
-            return None
+        if len(header.shape) != 3:
+            return "The data has " + str(len(header.shape)) + " dimensions instead of 3"
+        return None
 
-    def load_stimuli(self, path):
+    def load_anatomy(self, path):
+        error = self.check_anatomy(path)
+        if error:
+            return error
+        self.anatomy = Brain(path)
+        return None
+
+    def check_stimuli(self, path):
+        """ Check a stimuli file by reading it into a temporary. Returns an error message if it can not be opened, otherwise None """
         try:
-            temp_stimuli = Stimuli(path)
+            temp_stimuli = Stimuli(path, self.tr)
         except:
             return "The file is not a proper stimuli file. It might be corrupted or in the wrong format"
-        if isinstance(self, session.Session) and self.brain and temp_stimuli.data[-1, 0] > self.brain.images:
+        brain_header = self.get_header('brain') if isinstance(self, session.Session) else None
+        if brain_header and temp_stimuli.data[-1, 0] > brain_header.shape[3]:
             return "The times in the stimuli file are too long compared to the length of the EPI sequence"
-        else:
-            self.stimuli = temp_stimuli
-            self.stimuli.tr = self.tr
-            return None
+        return None
 
-    def load_mask(self, path):
+    def load_stimuli(self, path):
+        error = self.check_stimuli(path)
+        if error:
+            return error
+        self.stimuli = Stimuli(path, self.tr)
+        return None
+
+    def check_mask(self, path):
+        """ Check a mask by its header. Returns an error message if it can not be opened, otherwise None """
         try:
-            temp_mask = Mask(path)
+            header = read_header(path)
         except IOError:
             return path + " does not exist"
         except:
             return path + " could not be opened. It might be corrupted"
-        if len(temp_mask.shape) != 3:
-            return "The data has " + str(len(temp_mask.shape)) + " dimensions instead of 3"
-        elif isinstance(self, session.Session) and self.brain and self.brain.shape[0:3] != temp_mask.shape:
+        brain_header = self.get_header('brain') if isinstance(self, session.Session) else None
+        if len(header.shape) != 3:
+            return "The data has " + str(len(header.shape)) + " dimensions instead of 3"
+        elif brain_header and brain_header.shape[0:3] != header.shape:
             return "The mask is not the same size as the EPI sequence"
+        return None
+
+    def load_mask(self, path):
+        error = self.check_mask(path)
+        if error:
+            return error
+        self.mask = Mask(path)
+        return None
+
+    def defer_loading(self, name, configuration):
+        """
+        Open a file the first time it is used instead of now. Until then
+        its path is available through `get_path` without opening it.
+
+        :param name: Name of the file, 'brain', 'anatomy', 'mask' or 'stimuli'.
+        :param configuration: Configuration of the file, a dictionary with
+                              at least the path.
+        """
+        setattr(self, '_' + name, None)
+        self.unopened.pop(name, None)
+        self.pending[name] = configuration
+
+    def load_pending(self, name):
+        """
+        Open a file that was deferred by `defer_loading`. The file is left
+        unset if it could not be opened, but its configuration is kept in
+        `unopened` so that it is still saved with the configuration.
+
+        :return: An error message if the file could not be opened, otherwise None.
+        """
+        configuration = self.pending.pop(name)
+        path = configuration['path']
+
+        if name == 'brain':
+            error = self.load_sequence(path)
+        elif name == 'anatomy':
+            error = self.load_anatomy(path)
+        elif name == 'mask':
+            error = self.load_mask(path)
+        else:
+            error = self.load_stimuli(path)
+            if self._stimuli and 'baseline' in configuration:
+                self._stimuli.baseline = configuration['baseline']
+            if self._stimuli and 'interpolate' in configuration:
+                self._stimuli.interpolate = configuration['interpolate']
+
+        if error:
+            self.unopened[name] = configuration
+        return error
+
+    def get_deferred(self, name):
+        """ Return the configuration of a file that has not been opened, or None. """
+        return self.pending.get(name) or self.unopened.get(name)
+
+    def has_file(self, name):
+        """ Return whether the group has a file, without opening it. """
+        return self.get_deferred(name) is not None or getattr(self, '_' + name) is not None
+
+    def can_open(self, name):
+        """
+        Return whether a file is set and can be opened. Files waiting to be
+        opened are checked in the same way as when they are opened, images
+        by their headers and stimuli files by reading them into a
+        temporary, without opening them.
+        """
+        if name not in self.pending:
+            return getattr(self, '_' + name) is not None
+
+        path = self.pending[name]['path']
+        if name == 'brain':
+            return self.check_sequence(path) is None
+        elif name == 'anatomy':
+            return self.check_anatomy(path) is None
+        elif name == 'mask':
+            return self.check_mask(path) is None
         else:
-            self.mask = temp_mask
+            return self.check_stimuli(path) is None
+
+    def get_path(self, name):
+        """ Return the path of a file, or None if it is not set, without opening it. """
+        if self.get_deferred(name) is not None:
+            return self.get_deferred(name)['path']
+        file_ = getattr(self, '_' + name)
+        return file_.path if file_ is not None else None
+
+    def get_header(self, name):
+        """
+        Return the header of an image of the group without opening the
+        image, see `headers.read_header`.
+
+        :param name: Name of the image, 'brain', 'anatomy' or 'mask'.
+        :return: The header, or None if the image is not set or could not be read.
+        """
+        path = self.get_path(name)
+        if path is None:
+            return None
+        try:
+            return read_header(path)
+        except Exception:
             return None
 
+    def get_file_configuration(self, name):
+        """ Return the configuration of a file as it is saved, without opening it. """
+        if self.get_deferred(name) is not None:
+            configuration = dict(self.get_deferred(name))
+            if name == 'stimuli':
+                # The stimuli uses the tr of the group when it is opened
+                configuration['tr'] = self.tr
+            return configuration
+        return getattr(self, '_' + name).get_configuration()
+
     def add_child(self, child):
         self.children.append(child)
+        child.parent_group = self
 
     def remove_child(self, child):
         self.children.remove(child)
+        child.parent_group = None
+
+    def get_tree_path(self):
+        """
+        Return the names of the node and its parents separated by '/', such
+        as 'Project 1/Group 1/Individual 1/Session 1'. Siblings with the
+        same name are told apart, see `get_keys`, so the path is unique
+        within the tree.
+        """
+        parent = self.parent_group
+        if parent is None:
+            return get_keys([self])[0]
+
+        siblings = parent.children + parent.sessions
+        index = [id(sibling) for sibling in siblings].index(id(self))
+        return parent.get_tree_path() + '/' + get_keys(siblings)[index]
 
     def get_tr(self):
         children = self.children + self.sessions
@@ -232,11 +446,57 @@ class Group(object):
     def settings_changed(self, percentage, global_, mask, stimuli):
         """
         Ask every child if the settings from their previous aggregation is
-        different from the current settings
+        different from the current settings, and check that no child has
+        been added, removed or aggregated again since the previous
+        aggregation of the group.
         """
         return any([child.settings_changed(percentage, global_,
                                            mask, stimuli)
-                    for child in self.children + self.sessions])
+                    for child in self.children + self.sessions]) or \
+            self.child_versions != self.get_child_versions(mask, stimuli)
+
+    def get_child_versions(self, mask=None, stimuli=None):
+        """ Return the id and version of every child that is ready for calculation. """
+        if not mask:
+            mask = self.get_mask()
+        if not stimuli:
+            stimuli = self.get_stimuli()
+
+        return [(id(child), child.version) for child in self.children + self.sessions
+                if child.ready_for_calculation(mask, stimuli)]
+
+    @property
+    def responses(self):
+        """
+        A dictionary stimuli-values as keys NxM matrices as values where N
+        is the number of stimuli and M is the length of the shortest
+        stimuli. The responses of a group are concatenated from the
+        responses of its sessions the first time they are read after an
+        aggregation.
+        """
+        if self._responses is None:
+            self._responses = concatenate_responses(self.response_parts, self.baseline,
+                                                    self.response_width)
+        return self._responses
+
+    @responses.setter
+    def responses(self, responses):
+        self._responses = responses
+        self.response_parts = []
+
+    def get_response_parts(self):
+        """
+        :return: A list of tuples with the baseline and the responses of
+                 every session below the node that have not been
+                 concatenated yet, see `concatenate_responses`.
+        """
+        if self._responses is None:
+            return self.response_parts
+        return [(self.baseline, self._responses)]
+
+    def has_responses(self):
+        """ Return True if the node has been aggregated, without concatenating its responses. """
+        return any(responses for _, responses in self.get_response_parts())
 
     def aggregate(self, percentage=None, global_=None, mask=None, stimuli=None):
         """
@@ -247,12 +507,19 @@ class Group(object):
                  where N is the number of stimuli and M is the length of the
                  shortest stimuli.
         """
+        self.update_responses(percentage, global_, mask, stimuli)
+        return self.responses
+
+    def update_responses(self, percentage=None, global_=None, mask=None, stimuli=None):
+        """
+        Aggregate response data from children like `aggregate`, without
+        concatenating the responses of the sessions below the node.
+        """
         settings_changed = self.settings_changed(percentage, global_, mask, stimuli)
 
-        if self.responses and not settings_changed:
-            return self.responses
-        else:
-            return self._aggregate(percentage, global_, mask, stimuli)
+        if not self.has_responses() or settings_changed:
+            with profiler.span('aggregate', self.get_tree_path()):
+                self._aggregate(percentage, global_, mask, stimuli)
 
     def get_mean(self, percentage=None, global_=None, mask=None, stimuli=None):
         if percentage is None:
@@ -267,7 +534,7 @@ class Group(object):
         settings_changed = self.settings_changed(percentage, global_,
                                                  mask, stimuli)
         if settings_changed or not self.mean_responses:
-            self.mean_responses = self.calculate_mean(percentage, global_, mask, stimuli)
+            self.calculate_statistics(percentage, global_, mask, stimuli)
         return self.mean_responses
 
     def calculate_mean(self, percentage, global_, mask, stimuli):
@@ -278,65 +545,110 @@ class Group(object):
                  is the vector containing the mean value for the given time
                  frame.
         """
-        responses = self.aggregate(percentage, global_, mask, stimuli)
-        mean_responses = {}
+        return self.calculate_statistics(percentage, global_, mask, stimuli)['mean']
+
+    def calculate_statistics(self, percentage, global_, mask, stimuli):
+        """
+        Calculate the mean, standard error of the mean, standard deviation
+        and number of samples of every response grouped by stimuli type, and
+        store them in the members mean_responses, sem_responses,
+        std_responses and count_responses.
+
+        The statistics are derived from the block of the group, which is
+        merged from the blocks of the children instead of being calculated
+        from every response again.
+
+        :return: A dictionary with 'mean', 'sem', 'std' and 'count' as keys
+                 and dictionaries with stimuli types as keys and vectors
+                 with one value per time frame as values.
+        """
+        self.update_responses(percentage, global_, mask, stimuli)
+        statistics = {'mean': {}, 'sem': {}, 'std': {}, 'count': {}}
 
-        for stimuli_type, stimuli_data in responses.iteritems():
-            response_mean = np.zeros(stimuli_data.shape[1])
+        with profiler.span('statistics', self.get_tree_path()):
+            for stimuli_type, block in self.get_block().iteritems():
+                mean, sem, std, count = block_to_statistics(*block)
+                statistics['mean'][stimuli_type] = mean
+                statistics['sem'][stimuli_type] = sem
+                statistics['std'][stimuli_type] = std
+                statistics['count'][stimuli_type] = count
 
-            for i in range(stimuli_data.shape[1]):
-                rm1 = np.nonzero(stimuli_data[:, i])
-                # TODO: Motivate this if-statement
-                if len(rm1[0]) > 0:
-                    response_mean[i] = np.mean(stimuli_data[rm1[0], i])
+        self.mean_responses = statistics['mean']
+        self.sem_responses = statistics['sem']
+        self.std_responses = statistics['std']
+        self.count_responses = statistics['count']
 
-            mean_responses[stimuli_type] = response_mean
-        return mean_responses
+        return statistics
+
+    def get_block(self):
+        """
+        Return the statistics of the responses in a form that can be merged
+        with the statistics of other nodes, see `merge_blocks`.
+
+        The block of a group is merged from the blocks of its children when
+        it is aggregated. Nodes without children calculate it from their
+        responses the first time it is needed after an aggregation.
+
+        :return: A dictionary with stimuli values as keys and tuples with
+                 the number of samples, the mean and the sum of squared
+                 deviations from the mean of every column as values.
+        """
+        if self.block is None:
+            self.block = dict((stimuli_type, block_statistics(data))
+                              for stimuli_type, data in self.responses.iteritems())
+        return self.block
 
     def get_smooth(self, factor, splice=False):
         """
         Returnes the smoothed responses in the group.
 
+        The smoothed curves are calculated once per smoothing factor, see
+        `calculate_smooth`.
+
         Raises an Exception if a curve has too few data points for smoothing.
         :param factor: smoothing factor used
-        :param splice: Whether splice data shoud be returned or samples from
-        the spiced data on the x values in self.x_axis
+        :param splice: Whether splines through the smoothed curves should be
+        returned instead of the samples of the curves on the x values in
+        self.x_axis
         :return: A dictionary with stimuli values as keys and curves as values.
         If splice = False curves are of type numpy.array. If splice = True
-        curves are of type scipy.interpolate.UnivariateSpline
+        curves are splines of type scipy.interpolate.UnivariateSpline
         """
-        if not self.smoothed_responses:
+        method = self.get_smoothing_method()
+        if self.smoothed_responses is None or factor != self.smoothing_factor or \
+                method != self.smoothed_method:
             self.smoothing_factor = factor
+            self.smoothed_method = method
             self.peaks = None
             self.calculate_smooth()
-        if factor != self.smoothing_factor:
-            self.smoothing_factor = factor
-            self.peaks = None
-            for stim, curve in self.smoothed_responses.iteritems():
-                curve.set_smoothing_factor(s=factor)
         if splice:
-            return self.smoothed_responses
-        smoothed_curves = {}
-        for key in self.smoothed_responses:
-            smoothed_curves[key] = self.smoothed_responses[key](self.x_axis)
-        return smoothed_curves
+            if self.splines is None:
+                self.splines = smoothing.interpolate_curves(self.x_axis, self.smoothed_responses)
+            return self.splines
+        return self.smoothed_responses
 
     def calculate_smooth(self):
         """
-        Calculates smoothed curves for each stimuli value in the group and 
-        stores them in self.smoothed_responses.
+        Calculates smoothed curves for each stimuli value in the group and
+        stores them in self.smoothed_responses, using the method in
+        `smoothed_method`. Every curve is smoothed at once if the method
+        allows it.
         Raises Exception if a curve has too few data points for smoothing.
         """
         responses = self.get_mean()
-        self.smoothed_responses = {}
-        for key in responses.keys():
-            response = responses[key]
-            try:
-                self.smoothed_responses[key] = UnivariateSpline(
-                        self.x_axis, response, k=4, s=self.smoothing_factor)
-            except:
-                raise Exception("Smoothing error", 
-                        "Not enough data points for smoothing")
+        with profiler.span('smoothing', self.get_tree_path()):
+            self.smoothed_responses, self.splines = smoothing.smooth_curves(
+                self.x_axis, responses, self.smoothing_factor, self.smoothed_method)
+
+    def get_smoothing_method(self):
+        """
+        Return the method the mean responses are smoothed with: the one set
+        for every node in `smoothing_method`, otherwise the one saved in the
+        plot settings of the node, otherwise `smoothing.DEFAULT_METHOD`.
+        """
+        if self.smoothing_method:
+            return self.smoothing_method
+        return self.get_setting('smoothing_method') or smoothing.DEFAULT_METHOD
 
     def get_x_axis(self):
         return self.x_axis * self.get_tr()
@@ -350,25 +662,12 @@ class Group(object):
         settings_changed = self.settings_changed(percentage, global_,
                                                  self.mask, self.stimuli)
         if settings_changed or not self.sem_responses:
-            self.sem_responses = self.calculate_sem(percentage, global_)
+            self.calculate_statistics(percentage, global_, self.get_mask(), self.get_stimuli())
         return self.sem_responses
 
     def calculate_sem(self, percentage, global_):
         """ Calculate the standard error of the mean (SEM) of the response """
-        responses = self.aggregate(percentage, global_, self.get_mask(), self.get_stimuli())
-        responses_sem = {}
-
-        for stimuli_type, stimuli_data in responses.iteritems():
-            response_sem = np.zeros(stimuli_data.shape[1])
-
-            for i in range(stimuli_data.shape[1]):
-                rm1 = np.nonzero(stimuli_data[:, i])
-                if rm1[0].any():
-                    response_sem[i] = sem(stimuli_data[rm1[0], i], ddof=1)
-
-            responses_sem[stimuli_type] = response_sem
-
-        return responses_sem
+        return self.calculate_statistics(percentage, global_, self.get_mask(), self.get_stimuli())['sem']
 
     def get_configuration(self):
         configuration = {
@@ -379,46 +678,110 @@ class Group(object):
             'tr': self.tr,
             'groups': [group.get_configuration() for group in self.children],
         }
-        if self.anatomy:
-            configuration['anatomy_path'] = self.anatomy.path
+        if self.has_file('anatomy'):
+            configuration['anatomy_path'] = self.get_path('anatomy')
 
-        if self.mask:
-            configuration['mask'] = self.mask.get_configuration()
+        if self.has_file('mask'):
+            configuration['mask'] = self.get_file_configuration('mask')
 
-        if self.stimuli:
-            configuration['stimuli'] = self.stimuli.get_configuration()
+        if self.has_file('stimuli'):
+            configuration['stimuli'] = self.get_file_configuration('stimuli')
 
         return configuration
 
     def load_configuration(self, configuration):
+        """
+        Load the settings of the group from a configuration. The files are
+        not opened until they are used, see `defer_loading`.
+        """
         if 'name' in configuration:
             self.name = configuration['name']
         if 'anatomy_path' in configuration:
-            self.load_anatomy(configuration['anatomy_path'])
+            self.defer_loading('anatomy', {'path': configuration['anatomy_path']})
         if 'mask' in configuration:
-            self.load_mask(configuration['mask']['path'])
+            self.defer_loading('mask', configuration['mask'])
+        # The tr has to be set before the stimuli is loaded as it is used by the stimuli
+        if 'tr' in configuration:
+            self.tr = configuration['tr']
         if 'stimuli' in configuration:
-            self.load_stimuli(configuration['stimuli']['path'], configuration['stimuli']['tr'])
+            self.defer_loading('stimuli', configuration['stimuli'])
         if 'description' in configuration:
             self.description = configuration['description']
         if 'plot_settings' in configuration:
             self.plot_settings = configuration['plot_settings']
-        if 'tr' in configuration:
-            self.tr = configuration['tr']
 
     def add_session(self, session):
         self.sessions.append(session)
+        session.parent_group = self
 
     def remove_session(self, session):
         self.sessions.remove(session)
+        session.parent_group = None
+
+    def get_sessions(self, mask=None, stimuli=None):
+        """
+        Return every session below the group that would be aggregated with
+        the given settings.
+
+        :return: A list of (session, mask, stimuli) tuples with the mask and
+                 stimuli each session would be aggregated with.
+        """
+        if not mask:
+            mask = self.get_mask()
+        if not stimuli:
+            stimuli = self.get_stimuli()
+
+        sessions = []
+        for child in self.children + self.sessions:
+            if child.ready_for_calculation(mask, stimuli):
+                sessions += child.get_sessions(mask, stimuli)
+        return sessions
+
+    def aggregate_sessions(self, percentage, global_, mask, stimuli):
+        """
+        Calculate the responses of every session below the group that needs
+        to be aggregated in a pool of `self.workers` processes. The results
+        are stored in the sessions so that the following aggregation of the
+        group only merges them.
+        """
+        sessions = [(child, child_mask, child_stimuli)
+                    for child, child_mask, child_stimuli in self.get_sessions(mask, stimuli)
+                    if not child.responses or
+                    child.settings_changed(percentage, global_, child_mask, child_stimuli)]
+
+        if len(sessions) < 2:
+            return
+
+        arguments = [(child.get_path('brain'), child_mask.path, child_stimuli.path,
+                      child_stimuli.tr, child_stimuli.baseline, child_stimuli.interpolate,
+                      percentage, global_, session.Session.cache, Brain.volume_cache,
+                      child.get_tree_path())
+                     for child, child_mask, child_stimuli in sessions]
+
+        pool = multiprocessing.Pool(min(self.workers, len(sessions)))
+        try:
+            results = pool.map(session.calculate_responses, arguments)
+        finally:
+            pool.close()
+            pool.join()
+
+        for (child, child_mask, child_stimuli), result in zip(sessions, results):
+            masked_data, responses, x_axis, spans = result
+            child.set_responses(percentage, global_, child_mask, child_stimuli,
+                                masked_data, responses, x_axis)
+            profiler.spans.extend(spans)
 
     def _aggregate(self, percentage, global_, mask, stimuli):
-        self.responses = {}
-        min_width = float('inf')
+        if self.workers > 1:
+            self.aggregate_sessions(percentage, global_, mask, stimuli)
+
+        self.version += 1
 
         # Invalidate cached mean and sem
         self.sem_responses = None
         self.mean_responses = None
+        self.std_responses = None
+        self.count_responses = None
         self.smoothed_responses = None
         self.peaks = None
 
@@ -430,29 +793,67 @@ class Group(object):
             stimuli = self.get_stimuli()
             tr = self.get_tr()
 
+        # Children which have not changed keep their cached responses
+        ready_children = []
+        response_parts = []
         for child in self.children + self.sessions:
             # If the child doesn't have the files loaded, skip it.
             if not child.ready_for_calculation(mask, stimuli):
                 continue
-            child_response = child.aggregate(percentage, global_, mask, stimuli)
+            child.update_responses(percentage, global_, mask, stimuli)
+            ready_children.append(child)
+            response_parts.extend(child.get_response_parts())
 
-            for intensity, data in child_response.iteritems():
-                min_width = min(min_width, data.shape[1])
+        # Align the responses at the onsets if the children use different baselines
+        self.baseline = min([child.baseline for child in ready_children] or [0])
 
-                if intensity in self.responses:
-                    responses = self.responses[intensity][:, 0:min_width]
-                    data = data[:, 0:min_width]
-                    self.responses[intensity] = np.concatenate((responses, data))
-                else:
-                    self.responses[intensity] = data
+        # Set all data to match the length of the least wide response
+        widths = [data.shape[1] - (baseline - self.baseline)
+                  for baseline, responses in response_parts
+                  for data in responses.itervalues()]
+        width = min(widths or [0])
 
-        self.x_axis = np.array(list(range(min_width)))
+        self._responses = None
+        self.response_parts = response_parts
+        self.response_width = width
+        self.x_axis = np.array(list(range(width))) - self.baseline
 
-        # Set all data to match the length of the least wide response
-        for intensity, data in self.responses.iteritems():
-            self.responses[intensity] = data[:, 0:min_width]
+        self.block = self.merge_child_blocks(ready_children, width)
+        self.child_versions = [(id(child), child.version) for child in ready_children]
 
-        return self.responses
+    def merge_child_blocks(self, children, width):
+        """
+        Merge the blocks of the children into the block of the group. If the
+        children are aligned as in the previous aggregation, only the blocks
+        of the children that have been added, removed or aggregated again
+        since then are removed from or merged into the previous block.
+
+        :param children: The children that are ready for calculation.
+        :param width: Number of columns of the merged block.
+        :return: The merged block, see `get_block`.
+        """
+        child_blocks = dict((id(child), (child.version, child.baseline - self.baseline,
+                                         child.get_block()))
+                            for child in children)
+        previous = self.child_blocks
+        alignment = (self.baseline, width)
+
+        if self.block is None or previous is None or self.block_alignment != alignment:
+            block = merge_blocks([(offset, child_block)
+                                  for _, offset, child_block in child_blocks.itervalues()], width)
+        else:
+            block = self.block
+            for key, (version, offset, child_block) in previous.iteritems():
+                if key not in child_blocks or child_blocks[key][0] != version:
+                    block = remove_block(block, (offset, child_block), width)
+            changed = [(offset, child_block)
+                       for key, (version, offset, child_block) in child_blocks.iteritems()
+                       if key not in previous or previous[key][0] != version]
+            block = merge_blocks([(0, block)] + changed, width)
+
+        self.child_blocks = child_blocks
+        self.block_alignment = alignment
+        return block
 
     def get_setting(self, setting):
         """ 
@@ -475,3 +876,190 @@ class Group(object):
             return self.stimuli
         else:
             return None
+
+    def uses_file(self, name):
+        """
+        Return whether the mask or stimuli of the group is used in the
+        calculations and can be opened, see `get_mask`, `get_stimuli` and
+        `can_open`.
+        """
+        return (isinstance(self, session.Session) or self.get_setting('use_' + name)) and \
+            self.can_open(name)
+
+
+def get_key(node, index):
+    """ Return the name of a node in a path, which can not contain '/'. """
+    name = node.name.replace('/', '_').strip()
+    return name or str(index + 1)
+
+
+def make_unique(names):
+    """
+    Make the names of sibling nodes unique, so that nodes with the same
+    name do not overwrite each other. A name that has already been used
+    gets the position of the node appended, such as 'Session 1_3'. Names
+    are compared without case since some file systems ignore it.
+
+    :param names: List with the name of every node.
+    :return: List with a unique name for every node.
+    """
+    used = set()
+    unique = []
+    for index, name in enumerate(names):
+        while name.lower() in used:
+            name += '_' + str(index + 1)
+        used.add(name.lower())
+        unique.append(name)
+    return unique
+
+
+def get_keys(nodes):
+    """ Return a unique name in a path for every node in a list of siblings. """
+    return make_unique([get_key(node, index) for index, node in enumerate(nodes)])
+
+
+def masked_statistics(data):
+    """
+    Calculate statistics for every column of a matrix with one response per
+    row. Zeros are treated as missing samples and are excluded.
+
+    Columns without samples get a mean, SEM and standard deviation of zero.
+    The SEM and standard deviation of a column with a single sample is NaN,
+    as for `scipy.stats.sem` with one degree of freedom.
+
+    :param data: NxM matrix with N responses of length M.
+    :return: A tuple with the mean, SEM, standard deviation and number of
+             samples of every column.
+    """
+    return block_to_statistics(*block_statistics(data))
+
+
+def block_statistics(data):
+    """
+    Calculate the number of samples, the mean and the sum of squared
+    deviations from the mean of every column of a matrix with one response
+    per row. Zeros are treated as missing samples and are excluded.
+
+    :param data: NxM matrix with N responses of length M.
+    :return: A tuple with three vectors of length M.
+    """
+    samples = data != 0
+    count = np.count_nonzero(samples, axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, np.sum(data, axis=0) / count, 0.0)
+    deviation = np.where(samples, data - mean, 0.0)
+
+    return count, mean, np.sum(deviation ** 2, axis=0)
+
+
+def merge_blocks(blocks, width):
+    """
+    Merge the statistics of several nodes as if they had been calculated
+    from all of their responses at once, using the pairwise update of the
+    mean and sum of squared deviations by Chan et al.
+
+    :param blocks: List of tuples with the number of leading columns to skip
+                   in the block and a block from `Group.get_block`.
+    :param width: Number of columns of the merged block.
+    :return: A block with the merged statistics.
+    """
+    merged = {}
+    for offset, block in blocks:
+        for stimuli_type, (count, mean, m2) in block.iteritems():
+            count = count[offset:offset + width]
+            mean = mean[offset:offset + width]
+            m2 = m2[offset:offset + width]
+
+            if stimuli_type not in merged:
+                merged[stimuli_type] = (count, mean, m2)
+                continue
+
+            total_count, total_mean, total_m2 = merged[stimuli_type]
+            new_count = total_count + count
+            delta = mean - total_mean
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight = np.where(new_count > 0, count / new_count.astype(float), 0.0)
+            merged[stimuli_type] = (new_count, total_mean + delta * weight,
+                                    total_m2 + m2 + delta ** 2 * total_count * weight)
+
+    return merged
+
+
+def remove_block(merged, block, width):
+    """
+    Remove the statistics of a node from statistics it has been merged
+    into, the reverse of `merge_blocks`.
+
+    :param merged: A block from `merge_blocks`.
+    :param block: Tuple with the number of leading columns to skip in the
+                  block and the block that was merged into merged.
+    :param width: Number of columns of the merged block.
+    :return: A block with the remaining statistics.
+    """
+    offset, block = block
+    remaining = dict(merged)
+    for stimuli_type, (count, mean, m2) in block.iteritems():
+        count = count[offset:offset + width]
+        mean = mean[offset:offset + width]
+        m2 = m2[offset:offset + width]
+
+        total_count, total_mean, total_m2 = remaining[stimuli_type]
+        new_count = total_count - count
+        if not np.any(new_count):
+            del remaining[stimuli_type]
+            continue
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            new_mean = np.where(new_count > 0, (total_count * total_mean - count * mean) /
+                                new_count.astype(float), 0.0)
+            weight = np.where(total_count > 0, count / total_count.astype(float), 0.0)
+        delta = mean - new_mean
+        new_m2 = total_m2 - m2 - delta ** 2 * new_count * weight
+        remaining[stimuli_type] = (new_count, new_mean, np.maximum(new_m2, 0.0))
+
+    return remaining
+
+
+def concatenate_responses(parts, baseline, width):
+    """
+    Concatenate the responses of several nodes aligned at the onsets, with
+    one concatenation per stimuli value.
+
+    :param parts: List of tuples with the baseline and the responses of a
+                  node, see `Group.get_response_parts`.
+    :param baseline: Baseline of the concatenated responses, which is not
+                     larger than the baselines of the parts.
+    :param width: Number of columns of the concatenated responses.
+    :return: A dictionary with stimuli values as keys and the concatenated
+             responses as values.
+    """
+    columns = {}
+    for part_baseline, responses in parts:
+        offset = part_baseline - baseline
+        for stimuli_type, data in responses.iteritems():
+            columns.setdefault(stimuli_type, []).append(data[:, offset:offset + width])
+
+    return dict((stimuli_type, data[0] if len(data) == 1 else np.concatenate(data))
+                for stimuli_type, data in columns.iteritems())
+
+
+def block_to_statistics(count, mean, m2):
+    """
+    :return: A tuple with the mean, SEM, standard deviation and number of
+             samples from the statistics of a block, see `masked_statistics`.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(m2 / (count - 1))
+        sem = std / np.sqrt(count)
+
+    std[count == 0] = 0.0
+    sem[count == 0] = 0.0
+    std[count == 1] = np.nan
+    sem[count == 1] = np.nan
+
+    return mean, sem, std, count
+
+
+# Imported last since session.py needs Group to be defined
+import session
@@ -0,0 +1,74 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cached NIfTI headers.
+
+Files are checked against each other before they are opened, which only
+needs their headers. The headers are kept per path together with the
+modification time of the file, so a file is only read again when it has
+changed on disk.
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+import nibabel
+
+
+# Shape, voxel size, affine and data type of an image
+Header = namedtuple('Header', ['shape', 'zooms', 'affine', 'dtype'])
+
+_headers = {}
+_lock = threading.Lock()
+
+
+def read_header(path):
+    """
+    Return the header of an image without reading its data.
+
+    Raises IOError if the file does not exist, and the errors of nibabel if
+    it is not an image.
+
+    :param path: Path to a NIfTI file.
+    :return: Header of the image.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        raise IOError(path + " does not exist")
+
+    with _lock:
+        cached = _headers.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    image = nibabel.load(path)
+    header = Header(tuple(image.shape), tuple(image.header.get_zooms()), image.affine,
+                    image.header.get_data_dtype())
+
+    with _lock:
+        _headers[path] = (mtime, header)
+
+    return header
+
+
+def clear_headers():
+    """ Forget every header that has been read. """
+    with _lock:
+        _headers.clear()
@@ -0,0 +1,205 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Timing of the stages of the calculations.
+
+The calculations are wrapped in spans which record the wall time, the
+number of bytes read from EPI sequences and the peak memory of the process.
+Spans are recorded by the shared `profiler` for the path of a node in the
+tree, see `Group.get_tree_path`, and can be summarized per node and stage
+with `Profiler.get_report`.
+
+The peak memory of a span is the highest resident memory of the process
+while the span ran. It is sampled from /proc/self/statm by a thread which
+only runs while spans are open, so it is only known on Linux and a peak
+shorter than `Profiler.sample_interval` may be missed.
+"""
+
+import json
+import os
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+
+
+def get_memory():
+    """ Return the current resident memory of the process in bytes, or None if unknown. """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class Profiler(object):
+    """
+    Recorder of spans.
+
+    A span is a dictionary with the name of the stage, the path of the
+    project, group, individual or session it ran for, its wall time in
+    seconds, the number of bytes read during it and the peak memory of
+    the process while it ran.
+    """
+
+    # Seconds between the samples of the resident memory
+    sample_interval = 0.01
+
+    def __init__(self):
+        self.enabled = True
+        self.spans = []
+        self.bytes_read = 0
+        self.local = threading.local()
+        # Peak memory of every open span, updated by the sampler thread
+        self.open_peaks = []
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.pid = os.getpid()
+
+    def clear(self):
+        self.spans = []
+
+    def add_bytes_read(self, size):
+        """ Count bytes read from an EPI sequence. """
+        self.bytes_read += size
+
+    def start_sampling(self, peak):
+        """
+        Update the peak memory in the dictionary until `stop_sampling` is
+        called with it, and start the sampler thread if it is not running.
+        """
+        if self.pid != os.getpid():
+            # Worker processes get a copy of the profiler without the sampler thread
+            self.lock = threading.Lock()
+            self.sampler = None
+            self.open_peaks = []
+            self.pid = os.getpid()
+
+        with self.lock:
+            self.open_peaks.append(peak)
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample_memory)
+                self.sampler.daemon = True
+                self.sampler.start()
+
+    def stop_sampling(self, peak):
+        """ Take a last sample of the memory for the dictionary and stop updating it. """
+        memory = get_memory()
+        with self.lock:
+            peak['memory'] = max(peak['memory'], memory)
+            self.open_peaks = [open_peak for open_peak in self.open_peaks if open_peak is not peak]
+
+    def sample_memory(self):
+        """ Sample the memory for the open spans, until no span is open. """
+        while True:
+            memory = get_memory()
+            with self.lock:
+                if not self.open_peaks:
+                    self.sampler = None
+                    return
+                for peak in self.open_peaks:
+                    peak['memory'] = max(peak['memory'], memory)
+            time.sleep(self.sample_interval)
+
+    def get_node(self):
+        """ Return the node of the innermost span in this thread. """
+        nodes = getattr(self.local, 'nodes', None)
+        return nodes[-1] if nodes else None
+
+    @contextmanager
+    def span(self, name, node=None):
+        """
+        Record the code run within the with statement as a span.
+
+        :param name: Name of the stage.
+        :param node: Path of the node the stage runs for, see
+                     `Group.get_tree_path`. Spans nested within this span
+                     use the same node unless they specify another.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        if node is None:
+            node = self.get_node()
+        if not hasattr(self.local, 'nodes'):
+            self.local.nodes = []
+        self.local.nodes.append(node)
+
+        bytes_read = self.bytes_read
+        peak = {'memory': get_memory()}
+        if peak['memory'] is not None:
+            self.start_sampling(peak)
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            if peak['memory'] is not None:
+                self.stop_sampling(peak)
+            self.local.nodes.pop()
+            self.spans.append({
+                'name': name,
+                'node': node,
+                'wall_time': timeit.default_timer() - start,
+                'bytes_read': self.bytes_read - bytes_read,
+                'peak_memory': peak['memory']
+            })
+
+    def get_report(self):
+        """
+        Summarize the spans per node and stage.
+
+        :return: A dictionary with node paths as keys and dictionaries with
+                 stage names as keys as values. Every stage has the number
+                 of calls, total wall time, total bytes read and the highest
+                 peak memory of its spans.
+        """
+        report = {}
+        for span in self.spans:
+            stages = report.setdefault(span['node'] or '', {})
+            stage = stages.setdefault(span['name'], {'calls': 0, 'wall_time': 0.0,
+                                                     'bytes_read': 0, 'peak_memory': None})
+            stage['calls'] += 1
+            stage['wall_time'] += span['wall_time']
+            stage['bytes_read'] += span['bytes_read']
+            stage['peak_memory'] = max(stage['peak_memory'], span['peak_memory'])
+        return report
+
+    def format_report(self):
+        """ Return the report as a text table. """
+        lines = ['%-40s %-24s %6s %10s %12s %12s' % ('Node', 'Stage', 'Calls', 'Time (s)',
+                                                     'Read (MB)', 'Peak (MB)')]
+        for node, stages in sorted(self.get_report().iteritems()):
+            for name, stage in sorted(stages.iteritems()):
+                peak_memory = stage['peak_memory']
+                # The end of a long path tells the nodes apart
+                lines.append('%-40s %-24s %6d %10.3f %12.1f %12s' % (
+                    node[-40:], name[0:24], stage['calls'], stage['wall_time'],
+                    stage['bytes_read'] / 1024.0 ** 2,
+                    '%.1f' % (peak_memory / 1024.0 ** 2) if peak_memory else '-'))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """ Write the spans and the report as JSON to the path. """
+        with open(path, 'w') as f:
+            json.dump({'report': self.get_report(), 'spans': self.spans}, f, indent=4)
+
+
+# Profiler shared by the whole application
+profiler = Profiler()
@@ -20,8 +20,13 @@ import os
 import sys
 from sys import platform as _platform
 
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox
+from PyQt5.QtCore import Qt, QSettings
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QInputDialog, QMessageBox, QProgressDialog
 
+from brain import Brain
+from bulkexport import FORMATS
+from cache import ROICache, VolumeCache
+from calculationthread import CalculationThread
 from generated_ui.mainwindow import Ui_MainWindow
 from plotwindow import CustomPlot
 from stimuliwindow import StimuliWindow
@@ -30,6 +35,10 @@ from tree_items.grouptreeitem import GroupTreeItem
 from tree_items.individualtreeitem import IndividualTreeItem
 from tree_items.sessiontreeitem import SessionTreeItem
 from createmaskwindow import CreateMaskWindow
+from exportthread import ExportThread
+from instrumentation import profiler
+from session import Session
+from validationthread import ValidationThread
 
 try:
     import Cocoa    # Only used on Mac OS when building .app
@@ -64,6 +73,20 @@ class MainWindow(QMainWindow):
         self.current_config_path = ""
         self.ui.tree_widget.setColumnWidth(0, 200)
         self.projects = []
+        self.calculation = None
+        self.progress_dialog = None
+        self.validation = None
+
+        # Keep extracted ROI time series between runs
+        try:
+            Session.cache = ROICache(os.path.join(os.path.expanduser('~'), '.jabe', 'roi_cache'))
+        except OSError:
+            Session.cache = None
+
+        # Decompressed copies of compressed images are only kept if the
+        # user has turned the cache on, see volume_cache_pressed
+        self.settings = QSettings('jabe', 'jabe')
+        self.set_volume_cache(int(self.settings.value('volume_cache_size', 0)))
 
         self.update_gui()
 
@@ -101,6 +124,9 @@ class MainWindow(QMainWindow):
         self.ui.add_project_btn.clicked.connect(self.add_project_pressed)
         # Connect exit button
         self.ui.exit_menu_btn.triggered.connect(self.exit_button_pressed)
+        self.ui.timing_report_menu_btn.triggered.connect(self.timing_report_pressed)
+        self.ui.export_all_menu_btn.triggered.connect(self.export_all_pressed)
+        self.ui.volume_cache_menu_btn.triggered.connect(self.volume_cache_pressed)
         # Connect add project button
         self.ui.add_project_menu_btn.triggered.connect(self.add_project_pressed)
         # Connect add buttons for tree view
@@ -150,33 +176,6 @@ class MainWindow(QMainWindow):
         for button in plot_buttons:
             button.clicked.connect(self.plot_settings_changed)
 
-    def check_paths(self, configuration, type = None):
-        missing_paths = []
-        for project in configuration['project']:
-            missing_paths += (self.check_paths_in_object(project))
-            for group in project['groups']:
-                missing_paths += (self.check_paths_in_object(group))
-                for individual in group['groups']:
-                    missing_paths += (self.check_paths_in_object(individual))
-                    for session in individual['sessions']:
-                        missing_paths += (self.check_paths_in_object(session))
-
-        return missing_paths
-
-    def check_paths_in_object(self, config_obj):
-        missing_paths = []
-        if 'path' in config_obj and not os.path.exists(config_obj['path']):
-            missing_paths.append(config_obj['path'])
-        if 'anatomy_path' in config_obj and not os.path.exists(config_obj['anatomy_path']):
-            missing_paths.append(config_obj['anatomy_path'])
-        if 'mask' in config_obj and 'path' in config_obj['mask'] and not os.path.exists(config_obj['mask']['path']):
-            missing_paths.append(config_obj['mask']['path'] )
-        if 'stimuli' in config_obj and 'path' in config_obj['stimuli'] and \
-                not os.path.exists(config_obj['stimuli']['path']):
-            missing_paths.append(config_obj['stimuli']['path'])
-
-        return missing_paths
-
     def closeEvent(self, event):
         if self.projects != []:
             button = QMessageBox.question(self, "Save",
@@ -189,6 +188,13 @@ class MainWindow(QMainWindow):
                 if not success:
                     event.ignore()
 
+        # The thread must not be destroyed while it is running
+        if event.isAccepted() and self.calculation is not None and self.calculation.isRunning():
+            self.calculation.cancel()
+            self.calculation.wait()
+        if event.isAccepted() and self.validation is not None:
+            self.validation.wait()
+
     def save_configuration_as(self):
         config_file = QFileDialog.getSaveFileName(self, "", "", ".json")
         if config_file[0]:
@@ -303,11 +309,6 @@ class MainWindow(QMainWindow):
             with open(config_path, 'r') as f:
                 configuration = json.load(f)
 
-            missing_paths = self.check_paths(configuration)
-            if missing_paths:
-                QMessageBox.warning(self, "File error", "The following files are missing and will not be loaded:\n" +
-                                    "\n".join(missing_paths))
-
             self.ui.tree_widget.clear()
             self.projects = []
             if 'project' in configuration:
@@ -320,6 +321,18 @@ class MainWindow(QMainWindow):
 
             self.update_gui()
 
+            # The files are opened when they are first used, their headers
+            # are checked in the background meanwhile
+            self.validation = ValidationThread(configuration, self)
+            self.validation.validated.connect(self.validation_finished)
+            self.validation.start()
+
+    def validation_finished(self, messages):
+        if messages:
+            QMessageBox.warning(self, "File error", "The following problems were found with the files. "
+                                "The files are kept in the configuration, but the sessions that "
+                                "use them are skipped in the calculations:\n" + "\n".join(messages))
+
     def create_new_configuration(self):
         if self.projects != []:
             button = QMessageBox.question(
@@ -389,7 +402,113 @@ class MainWindow(QMainWindow):
         # Make sure to update plot settings at least once before running
 
         self.plot_settings_changed()
-        CustomPlot(self, self.ui.tree_widget.selectedItems()[0])
+
+        if self.calculation is not None and self.calculation.isRunning():
+            return
+
+        node = self.ui.tree_widget.selectedItems()[0]
+
+        # Calculate the results in the background and plot them when done
+        self.calculation = CalculationThread(node, self)
+        self.create_progress_dialog("Calculating", "Calculating " + node.name + "...")
+        self.calculation.calculated.connect(lambda: CustomPlot(self, node))
+
+        self.calculation.start()
+
+    def create_progress_dialog(self, title, text):
+        """
+        Show the progress of the thread in self.calculation, which can be
+        cancelled from the dialog.
+        """
+        self.progress_dialog = QProgressDialog(text, "Cancel", 0, 0, self)
+        self.progress_dialog.setWindowTitle(title)
+        self.progress_dialog.setWindowModality(Qt.WindowModal)
+        self.progress_dialog.setAutoReset(False)
+        self.progress_dialog.setMinimumDuration(500)
+
+        self.progress_dialog.canceled.connect(self.calculation.cancel)
+        self.calculation.progress.connect(self.calculation_progress)
+        self.calculation.failed.connect(self.calculation_failed)
+        self.calculation.finished.connect(self.progress_dialog.close)
+
+    def export_all_pressed(self):
+        """ Export the results of every node in the workspace to a directory. """
+        if not self.projects:
+            QMessageBox.information(self, "Export all results", "There is nothing to export.")
+            return
+
+        if self.calculation is not None and self.calculation.isRunning():
+            return
+
+        format_, ok = QInputDialog.getItem(self, "Export all results", "File format:", FORMATS, 0, False)
+        if not ok:
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Export all results to")
+        if not directory:
+            return
+
+        # The export runs as a calculation so that it never runs at the same time as one
+        self.calculation = ExportThread(self.projects, directory, str(format_), self)
+        self.create_progress_dialog("Exporting", "Exporting all results...")
+        self.calculation.exported.connect(
+            lambda count: QMessageBox.information(self, "Export all results", "The results of " + str(count) +
+                                                  " nodes were exported to " + directory))
+
+        self.calculation.start()
+
+    def set_volume_cache(self, size):
+        """
+        Keep decompressed copies of compressed images between runs, see
+        `cache.VolumeCache`.
+
+        :param size: Maximum size of the copies in MB, 0 turns the cache off.
+        """
+        Brain.volume_cache = None
+        if size > 0:
+            try:
+                Brain.volume_cache = VolumeCache(
+                    os.path.join(os.path.expanduser('~'), '.jabe', 'volume_cache'), size * 1024 ** 2)
+            except OSError:
+                pass
+
+    def volume_cache_pressed(self):
+        """ Ask for the size of the volume cache and save it in the settings. """
+        size, ok = QInputDialog.getInt(
+            self, "Volume cache",
+            "Maximum size in MB of the decompressed copies of .nii.gz files kept in\n" +
+            os.path.join(os.path.expanduser('~'), '.jabe', 'volume_cache') + ", 0 turns the cache off:",
+            int(self.settings.value('volume_cache_size', 0)), 0, 1024 ** 2, 256)
+        if not ok:
+            return
+        self.settings.setValue('volume_cache_size', size)
+        self.set_volume_cache(size)
+
+    def calculation_progress(self, done, total, name):
+        """ Callback function run when a session has been calculated. """
+        self.progress_dialog.setMaximum(total)
+        self.progress_dialog.setValue(done)
+        self.progress_dialog.setLabelText("Calculated " + name + " (" + str(done) + " of " + str(total) + ")")
+
+    def timing_report_pressed(self):
+        """ Show the time spent in every stage of the latest calculation. """
+        if not profiler.spans:
+            QMessageBox.information(self, "Timing report", "Nothing has been calculated yet.")
+            return
+
+        message = QMessageBox(self)
+        message.setWindowTitle("Timing report")
+        message.setText("Time spent in every stage of the latest calculation.")
+        message.setDetailedText(profiler.format_report())
+        message.setStandardButtons(QMessageBox.Save | QMessageBox.Close)
+
+        if message.exec_() == QMessageBox.Save:
+            file_name = QFileDialog.getSaveFileName(self, "Save timing report", "", "JSON (*.json)")
+            if file_name[0]:
+                profiler.save(file_name[0])
+
+    def calculation_failed(self, message):
+        """ Callback function run when the calculation raised an error. """
+        QMessageBox.warning(self, "Calculation error", message)
 
     def brain_button_pressed(self):
         """ Callback function run when the choose brain button is pressed."""
@@ -586,38 +705,38 @@ class MainWindow(QMainWindow):
             if isinstance(self.ui.tree_widget.selectedItems()[0], SessionTreeItem):
                 session = self.ui.tree_widget.selectedItems()[0]
 
-                if session.brain:
-                    self.ui.session_epi_label.setText('EPI-images chosen: ' + session.brain.path.split('/')[-1])
+                if session.has_file('brain'):
+                    self.ui.session_epi_label.setText('EPI-images chosen: ' + session.get_path('brain').split('/')[-1])
                 else:
                     self.ui.session_epi_label.setText('No EPI-images chosen')
 
-                if session.anatomy:
-                    self.ui.session_anatomy_label.setText('Anatomy chosen: ' + session.anatomy.path.split('/')[-1])
+                if session.has_file('anatomy'):
+                    self.ui.session_anatomy_label.setText('Anatomy chosen: ' + session.get_path('anatomy').split('/')[-1])
                 else:
                     self.ui.session_anatomy_label.setText('No anatomy chosen')
 
-                if session.mask:
-                    self.ui.session_mask_label.setText('Mask picked: ' + session.mask.path.split('/')[-1])
+                if session.has_file('mask'):
+                    self.ui.session_mask_label.setText('Mask picked: ' + session.get_path('mask').split('/')[-1])
                 else:
                     self.ui.session_mask_label.setText('No mask chosen')
 
-                if session.stimuli:
-                    self.ui.session_stimuli_label.setText('Stimuli picked: ' + session.stimuli.path.split('/')[-1])
+                if session.has_file('stimuli'):
+                    self.ui.session_stimuli_label.setText('Stimuli picked: ' + session.get_path('stimuli').split('/')[-1])
                 else:
                     self.ui.session_stimuli_label.setText('No stimuli chosen')
             elif isinstance(self.ui.tree_widget.selectedItems()[0], IndividualTreeItem):
                 individual = self.ui.tree_widget.selectedItems()[0]
 
-                if individual.anatomy:
-                    self.ui.individual_anatomy_label.setText('Anatomy chosen: ' + individual.anatomy.path.split('/')[-1])
+                if individual.has_file('anatomy'):
+                    self.ui.individual_anatomy_label.setText('Anatomy chosen: ' + individual.get_path('anatomy').split('/')[-1])
                 else:
                     self.ui.individual_anatomy_label.setText('No anatomy chosen')
-                if individual.mask:
-                    self.ui.individual_mask_label.setText('Mask chosen: ' + individual.mask.path.split('/')[-1])
+                if individual.has_file('mask'):
+                    self.ui.individual_mask_label.setText('Mask chosen: ' + individual.get_path('mask').split('/')[-1])
                 else:
                     self.ui.individual_mask_label.setText('No mask chosen')
-                if individual.stimuli:
-                    self.ui.individual_stimuli_label.setText('Stimuli chosen: ' + individual.stimuli.path.split('/')[-1])
+                if individual.has_file('stimuli'):
+                    self.ui.individual_stimuli_label.setText('Stimuli chosen: ' + individual.get_path('stimuli').split('/')[-1])
                 else:
                     self.ui.individual_stimuli_label.setText('No stimuli chosen')
 
@@ -634,16 +753,16 @@ class MainWindow(QMainWindow):
             elif isinstance(self.ui.tree_widget.selectedItems()[0], GroupTreeItem):
                 group = self.ui.tree_widget.selectedItems()[0]
 
-                if group.anatomy:
-                    self.ui.group_anatomy_label.setText('Anatomy chosen: ' + group.anatomy.path.split('/')[-1])
+                if group.has_file('anatomy'):
+                    self.ui.group_anatomy_label.setText('Anatomy chosen: ' + group.get_path('anatomy').split('/')[-1])
                 else:
                     self.ui.group_anatomy_label.setText('No anatomy chosen')
-                if group.mask:
-                    self.ui.group_mask_label.setText('Mask chosen: ' + group.mask.path.split('/')[-1])
+                if group.has_file('mask'):
+                    self.ui.group_mask_label.setText('Mask chosen: ' + group.get_path('mask').split('/')[-1])
                 else:
                     self.ui.group_mask_label.setText('No mask chosen')
-                if group.stimuli:
-                    self.ui.group_stimuli_label.setText('Stimuli chosen: ' + group.stimuli.path.split('/')[-1])
+                if group.has_file('stimuli'):
+                    self.ui.group_stimuli_label.setText('Stimuli chosen: ' + group.get_path('stimuli').split('/')[-1])
                 else:
                     self.ui.group_stimuli_label.setText('No stimuli chosen')
 
@@ -660,16 +779,16 @@ class MainWindow(QMainWindow):
             elif isinstance(self.ui.tree_widget.selectedItems()[0], ProjectTreeItem):
                 group = self.ui.tree_widget.selectedItems()[0]
 
-                if group.anatomy:
-                    self.ui.brainLabel_6.setText('Anatomy chosen: ' + group.anatomy.path.split('/')[-1])
+                if group.has_file('anatomy'):
+                    self.ui.brainLabel_6.setText('Anatomy chosen: ' + group.get_path('anatomy').split('/')[-1])
                 else:
                     self.ui.brainLabel_6.setText('No anatomy chosen')
-                if group.mask:
-                    self.ui.maskLabel_6.setText('Mask chosen: ' + group.mask.path.split('/')[-1])
+                if group.has_file('mask'):
+                    self.ui.maskLabel_6.setText('Mask chosen: ' + group.get_path('mask').split('/')[-1])
                 else:
                     self.ui.maskLabel_6.setText('No mask chosen')
-                if group.stimuli:
-                    self.ui.stimuliLabel_6.setText('Stimuli chosen: ' + group.stimuli.path.split('/')[-1])
+                if group.has_file('stimuli'):
+                    self.ui.stimuliLabel_6.setText('Stimuli chosen: ' + group.get_path('stimuli').split('/')[-1])
                 else:
                     self.ui.stimuliLabel_6.setText('No stimuli chosen')
 
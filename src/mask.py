@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with JABE.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+
 import nibabel as nib
 import numpy as np
 
@@ -27,77 +29,157 @@ class Mask:
     accessed through the member called data.
     """
 
-    def __init__(self, path=None, shape=None, coordinate=None, width=None, brain_file=None):
+    def __init__(self, path=None, shape=None, coordinate=None, width=None, brain_file=None,
+                 millimetres=False):
         """ Load a mask from a path or create a mask from the specified data
         :param path: Path for the NIfTI file
-        :param shape: The shape of the ROI, cube or sphere
-        :param coordinate: Coordinates for the center point of the ROI
-        :param width: The size of the ROI
+        :param shape: The shape of the ROI, "Box" (or "Cube") or "Sphere"
+        :param coordinate: Coordinates for the center point of the ROI in voxels
+        :param width: The size of the ROI along each axis. The edge lengths
+                      of a box or the radii of a sphere, which becomes an
+                      ellipsoid if the radii differ.
         :param brain_file: The EPI-image
+        :param millimetres: Whether the width is given in millimetres instead
+                            of voxels. The width is converted to voxels with
+                            the voxel size of the EPI-image, so that the ROI
+                            keeps its shape for anisotropic voxels.
         """
+        # Compact representation of the ROI, see load_roi
+        self.roi = None
+        # Value of the ROI in the atlas it was taken from, see get_labels
+        self.label = None
+
         # If we do not get a width,then we load a path.
         # Otherwise we make a new mask with the specified data.
-        if width == None:
+        if width is None:
             self.path = path
             self.mask_file = nib.load(path)
         else:
-            voxel_size = brain_file._header.get_zooms()
-            size = brain_file.get_data().shape[0:3]
-
-            # Create empty matrix of correct size
-            self.data = np.zeros(size)
-
-
-            # Set ones in a volume of a cube around the specified coordinate
-            if shape == "Box":
-                for z in range(int(coordinate[2] - width[2] / 2),
-                               int(coordinate[2] + width[2] / 2 + 1)):
-                    for y in range(int(coordinate[1] - width[1] / 2),
-                                   int(coordinate[1] + width[1] / 2 + 1)):
-                        for x in range(int(coordinate[0] - width[0] / 2),
-                                       int(coordinate[0] + width[0] / 2 + 1)):
-                            self.data[x, y, z] = 1
-
-            # Set ones in every coordinate within the distance radius_width around the coordinate, making it a sphere
-            if shape == "Sphere":
-                for z in range(0, size[2]):
-                    for y in range(0, size[1]):
-                        for x in range(0, size[0]):
-                            if (coordinate[2] - z) ** 2 + (coordinate[1] - y) ** 2 + (
-                                        coordinate[0] - x) ** 2 <= width[0] ** 2:
-                                self.data[x, y, z] = 1
+            voxel_size = brain_file._header.get_zooms()[0:3]
+            size = brain_file.shape[0:3]
+
+            width = np.array(width, dtype=float)
+            if millimetres:
+                width = width / np.array(voxel_size, dtype=float)
+
+            if shape in ("Box", "Cube"):
+                radii = width / 2
+            elif shape == "Sphere":
+                radii = width
+            else:
+                raise ValueError("Unknown ROI shape " + str(shape))
+
+            data = create_roi(size, shape, coordinate, radii)
 
             # Create a nifti file containing the data and save it to path
-            mask_file = nib.Nifti1Image(self.data, brain_file._affine)
-            nib.save(mask_file, path)
+            self.path = path
+            self.mask_file = nib.Nifti1Image(data, brain_file._affine)
+            nib.save(self.mask_file, path)
 
     def get_configuration(self):
         return {'path': self.path}
 
+    def load_roi(self):
+        """
+        Build the compact representation of the ROI from the mask data.
+
+        The voxels of the ROI are stored as int32 indices into the
+        flattened volume, together with their values when the mask is not
+        binary, the bounding box of the ROI and the number of voxels. It is
+        built the first time it is used, after which the dense data is not
+        needed anymore.
+        """
+        data = np.asanyarray(self.mask_file.dataobj)
+        flat_data = data.ravel()
+
+        indices = np.flatnonzero(flat_data)
+        values = flat_data[indices].astype(np.float64)
+        coordinates = np.unravel_index(indices, data.shape)
+
+        if indices.size:
+            bounding_box = tuple(slice(axis.min(), axis.max() + 1) for axis in coordinates[0:3])
+        else:
+            bounding_box = (slice(0, 0),) * 3
+
+        self.roi = {
+            'indices': indices.astype(np.int32),
+            'weights': None if np.all(values == 1) else values,
+            'bounding_box': bounding_box,
+            'count': indices.size
+        }
+
+    def get_labels(self):
+        """
+        Split a labelled atlas, where the voxels of each ROI have the same
+        value, into one mask per ROI. The masks share the data of the atlas
+        and only hold the compact representation of their own ROI.
+
+        :return: A list of binary masks sorted by label. The label of each
+                 mask is stored in its member label.
+        """
+        if self.weights is None:
+            return [self]
+
+        order = np.argsort(self.weights, kind='mergesort')
+        labels, starts = np.unique(self.weights[order], return_index=True)
+
+        masks = []
+        for label, indices in zip(labels, np.split(self.indices[order], starts[1:])):
+            coordinates = np.unravel_index(indices, self.shape)
+
+            mask = copy.copy(self)
+            mask.label = label
+            mask.roi = {
+                'indices': indices,
+                'weights': None,
+                'bounding_box': tuple(slice(axis.min(), axis.max() + 1) for axis in coordinates[0:3]),
+                'count': indices.size
+            }
+            masks.append(mask)
+
+        return masks
+
+    def get_coordinates(self):
+        """
+        :return: A tuple with one array per axis with the coordinates of the
+                 voxels in the ROI, in the same order as `indices`.
+        """
+        return np.unravel_index(self.indices, self.shape)
+
     def get_index_of_roi(self):
-        most_ones = np.array([[0,0,0]])
-        ones_amount = 0
-        for i in range(self.data.shape[0]):
-            ones = np.count_nonzero(self.data[i,:,:])
-            if ones > ones_amount:
-                ones_amount = ones
-                most_ones[0][0] = i
-
-        ones_amount = 0
-        for i in range(self.data.shape[1]):
-            ones = np.count_nonzero(self.data[:,i,:])
-            if ones > ones_amount:
-                ones_amount = ones
-                most_ones[0][1] = i
-
-        ones_amount = 0
-        for i in range(self.data.shape[2]):
-            ones = np.count_nonzero(self.data[:,:,i])
-            if ones > ones_amount:
-                ones_amount = ones
-                most_ones[0][2] = i
-
-        return most_ones
+        """
+        Return the index of the slice with the most voxels of the ROI along
+        each axis.
+
+        The number of voxels per slice is counted for all slices at once by
+        projecting the coordinates of the ROI onto each axis. The result is
+        cached together with the rest of the compact representation.
+
+        :return: A 1x3 array with one slice index per axis.
+        """
+        if self.roi is None:
+            self.load_roi()
+
+        if 'index' not in self.roi:
+            coordinates = self.get_coordinates()
+            self.roi['index'] = np.array([[np.argmax(np.bincount(axis, minlength=1))
+                                           for axis in coordinates[0:3]]])
+
+        return self.roi['index']
+
+    def get_centroid(self):
+        """
+        :return: The mean coordinate of the voxels in the ROI, or None if the
+                 ROI is empty.
+        """
+        if not self.count:
+            return None
+
+        if 'centroid' not in self.roi:
+            coordinates = self.get_coordinates()
+            self.roi['centroid'] = np.array([np.mean(axis) for axis in coordinates[0:3]])
+
+        return self.roi['centroid']
 
     @property
     def shape(self):
@@ -107,9 +189,74 @@ class Mask:
     def data(self):
         return self.mask_file.get_data()
 
+    @property
+    def indices(self):
+        """ Indices of the voxels in the ROI in the flattened volume. """
+        if self.roi is None:
+            self.load_roi()
+        return self.roi['indices']
+
+    @property
+    def weights(self):
+        """ Values of the voxels in the ROI, or None if the mask is binary. """
+        if self.roi is None:
+            self.load_roi()
+        return self.roi['weights']
+
+    @property
+    def bounding_box(self):
+        """ Tuple with one slice per axis containing all voxels in the ROI. """
+        if self.roi is None:
+            self.load_roi()
+        return self.roi['bounding_box']
+
+    @property
+    def count(self):
+        """ Number of voxels in the ROI. """
+        if self.roi is None:
+            self.load_roi()
+        return self.roi['count']
+
     @property
     def images(self):
         if self.mask_file.shape < 4:
             return 1
         else:
             return self.mask_file.shape[3]
+
+
+def create_roi(size, shape, coordinate, radii):
+    """
+    Create the data of a box or an ellipsoid shaped ROI.
+
+    Only the voxels within the bounding box of the ROI are tested, using
+    coordinate grids broadcast against each other instead of a full grid.
+
+    :param size: Shape of the volume.
+    :param shape: "Box" (or "Cube") or "Sphere".
+    :param coordinate: Center of the ROI in voxels.
+    :param radii: Half the edge length of the box, or the radius of the
+                  ellipsoid, along each axis in voxels.
+    :return: Array of the given size with ones within the ROI.
+    """
+    data = np.zeros(size)
+    coordinate = np.asarray(coordinate, dtype=float)
+    # A ROI always covers the voxel nearest to its center
+    radii = np.maximum(np.asarray(radii, dtype=float), 0.5)
+
+    lower = np.maximum(np.floor(coordinate - radii), 0).astype(int)
+    upper = np.minimum(np.ceil(coordinate + radii) + 1, size).astype(int)
+    if np.any(upper <= lower):
+        return data
+
+    # Distances to the center relative to the radii, one broadcastable array per axis
+    grid = np.ogrid[lower[0]:upper[0], lower[1]:upper[1], lower[2]:upper[2]]
+    distances = [np.abs(axis - center) / radius for axis, center, radius in zip(grid, coordinate, radii)]
+
+    if shape == "Sphere":
+        roi = distances[0] ** 2 + distances[1] ** 2 + distances[2] ** 2 <= 1
+    else:
+        roi = (distances[0] <= 1) & (distances[1] <= 1) & (distances[2] <= 1)
+
+    data[lower[0]:upper[0], lower[1]:upper[1], lower[2]:upper[2]] = roi
+    return data
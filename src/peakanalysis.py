@@ -0,0 +1,137 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Peaks, latencies and FWHM of smoothed responses.
+
+All curves of a node are analysed at once from their smoothed samples.
+The peak is the highest local maximum within the curve, refined with a
+parabola through the three samples around it. Crossings of a level, such
+as half of the maximum, are found from the sign changes between samples
+and refined with linear interpolation.
+
+Times are given in the units of the x axis, where the stimuli starts at 0.
+The onset latency is taken from the crossing closest to the peak, so that
+noise in the baseline does not move it.
+"""
+
+import numpy as np
+
+# Fraction of the amplitude the response has to reach to have started
+ONSET_LEVEL = 0.1
+
+
+def interpolate_at(x, curves, position):
+    """ Return the value of every curve at a position on the x axis. """
+    index = np.interp(position, x, np.arange(len(x)))
+    lower = min(int(np.floor(index)), len(x) - 2)
+    weight = index - lower
+    return curves[:, lower] * (1 - weight) + curves[:, lower + 1] * weight
+
+
+def find_crossings(x, curves, level, peak_index):
+    """
+    Find where every curve crosses its level closest to its peak, on both
+    sides of the peak.
+
+    :param x: Positions of the samples.
+    :param curves: NxM matrix with N curves of M samples.
+    :param level: Level of every curve.
+    :param peak_index: Index of the sample of the peak of every curve.
+    :return: A tuple with the positions of the crossings before and after
+             the peaks, NaN where a curve does not cross its level.
+    """
+    rows = np.arange(curves.shape[0])
+    segments = np.arange(curves.shape[1] - 1)
+
+    difference = curves - level[:, np.newaxis]
+    above = difference >= 0
+    # Segment j crosses the level between the samples j and j + 1
+    crossing = above[:, :-1] != above[:, 1:]
+
+    before = crossing & (segments < peak_index[:, np.newaxis])
+    after = crossing & (segments >= peak_index[:, np.newaxis])
+
+    last_before = segments[-1] - np.argmax(before[:, ::-1], axis=1)
+    first_after = np.argmax(after, axis=1)
+
+    def refine(segment, found):
+        start = difference[rows, segment]
+        end = difference[rows, segment + 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = start / (start - end)
+        position = x[segment] + fraction * (x[segment + 1] - x[segment])
+        return np.where(found, position, np.nan)
+
+    return refine(last_before, before.any(axis=1)), refine(first_after, after.any(axis=1))
+
+
+def analyze_curves(x, curves):
+    """
+    Analyse smoothed curves sampled at the same positions.
+
+    :param x: Positions of the samples, evenly spaced.
+    :param curves: NxM matrix with N curves of M samples.
+    :return: A dictionary with vectors of one value per curve:
+             'valid' whether the curve has a peak within the curve,
+             'peak_time' and 'peak_value' the position and value of the peak,
+             'onset_value' the value when the stimuli starts,
+             'amplitude' the peak value minus the onset value,
+             'onset_latency' when the curve rises above 10 % of the
+                             amplitude for the last time before the peak,
+             'time_to_peak' the time from the onset latency to the peak, and
+             'fwhm_start' and 'fwhm_end' where the curve crosses half of
+                          the amplitude around the peak.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    curves = np.atleast_2d(np.asarray(curves, dtype=np.float64))
+    rows = np.arange(curves.shape[0])
+
+    # Local maxima, the ends of the curves are not peaks
+    maxima = np.zeros(curves.shape, dtype=bool)
+    maxima[:, 1:-1] = (curves[:, 1:-1] >= curves[:, :-2]) & (curves[:, 1:-1] > curves[:, 2:])
+    valid = maxima.any(axis=1)
+    peak_index = np.argmax(np.where(maxima, curves, -np.inf), axis=1)
+    peak_index = np.clip(peak_index, 1, curves.shape[1] - 2)
+
+    # Vertex of the parabola through the peak sample and its neighbours
+    left = curves[rows, peak_index - 1]
+    centre = curves[rows, peak_index]
+    right = curves[rows, peak_index + 1]
+    curvature = left - 2 * centre + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+    peak_time = x[peak_index] + offset * (x[1] - x[0])
+    peak_value = centre - 0.25 * (left - right) * offset
+
+    onset_value = interpolate_at(x, curves, 0)
+    amplitude = peak_value - onset_value
+
+    fwhm_start, fwhm_end = find_crossings(x, curves, onset_value + amplitude / 2, peak_index)
+    onset_latency, _ = find_crossings(x, curves, onset_value + ONSET_LEVEL * amplitude, peak_index)
+
+    return {
+        'valid': valid,
+        'peak_time': peak_time,
+        'peak_value': peak_value,
+        'onset_value': onset_value,
+        'amplitude': amplitude,
+        'onset_latency': onset_latency,
+        'time_to_peak': peak_time - onset_latency,
+        'fwhm_start': fwhm_start,
+        'fwhm_end': fwhm_end
+    }
@@ -27,6 +27,8 @@ from exportwindow import ExportWindow
 from src.generated_ui.custom_plot import Ui_Dialog
 from session import Session
 from anatomywindow import AnatomyWindow
+from smoothing import get_smoothing_factor
+from smoothing import METHODS
 
 
 class CustomPlot(QDialog):
@@ -95,6 +97,10 @@ class CustomPlot(QDialog):
 
         self.ui.spinBox.valueChanged.connect(self.replot)
 
+        self.ui.smoothing_method_box.addItems(METHODS)
+        self.ui.smoothing_method_box.setCurrentText(session.get_smoothing_method())
+        self.ui.smoothing_method_box.currentTextChanged.connect(self.smoothing_method_changed)
+
         self.ui.toolButton_home.clicked.connect(self.toolbar.home)
         self.ui.toolButton_export.clicked.connect(self.tool_export)
         self.ui.toolButton_pan.clicked.connect(self.toolbar.pan)
@@ -121,9 +127,11 @@ class CustomPlot(QDialog):
         self.canvas.mpl_connect('button_press_event', self.click_plot)
         self.fig.tight_layout(pad=2.0)
 
-        # Change default value in smooth wheel if percent is used
-        if self.session.get_setting("percent"):
-            self.ui.spinBox.setValue(2)
+        # The smooth wheel starts with the factor saved for the node. Only
+        # factors the user chooses are saved, so that the default follows
+        # the normalization
+        self.ui.spinBox.setValue(get_smoothing_factor(self.session))
+        self.ui.spinBox.valueChanged.connect(self.smoothing_factor_changed)
 
         self.replot()
         self.show()
@@ -197,8 +205,7 @@ class CustomPlot(QDialog):
     def add_ax(self, ax):
         if ax is not None:
             self.ax_list.append(ax)
-            # Change default value in smooth wheel if percent is used
-            smooth = 2 if self.session.get_setting("percent") else 20
+            smooth = get_smoothing_factor(self.session)
             self.axes[ax] = {'plot': 'mean',
                              'data': {'regular': False,
                                       'smooth': False,
@@ -308,6 +315,9 @@ class CustomPlot(QDialog):
                 return
             fwhm_text = ""
             for stimuli_val, values in fwhm.iteritems():
+                if np.isnan(values).any():
+                    fwhm_text += "FWHM " + stimuli_val + ": no half maximum on both sides of the peak\n"
+                    continue
                 self.fwhm.append(self.current_ax.axvspan(
                         values[0], values[1], facecolor='g', alpha=0.2))
                 fwhm_text += "FWHM " + stimuli_val + " width: " + \
@@ -318,6 +328,28 @@ class CustomPlot(QDialog):
             self.ui.fwhm_label.hide()
         self.canvas.draw()
                 
+    def smoothing_factor_changed(self, factor):
+        """
+        Save the factor in the plot settings of the node for the current
+        smoothing method, so that the results calculated before the node is
+        plotted again use it, see `smoothing.get_smoothing_factor`.
+        """
+        factors = self.session.plot_settings.setdefault('smoothing_factors', {})
+        factors[self.session.get_smoothing_method()] = factor
+
+    def smoothing_method_changed(self, method):
+        """
+        Smooth the responses with another method. The method is saved in
+        the plot settings of the node, and the smooth wheel is set to the
+        factor last used with the method, or its default, since the factors
+        of the methods are different quantities.
+        """
+        self.session.plot_settings['smoothing_method'] = method
+        self.ui.spinBox.blockSignals(True)
+        self.ui.spinBox.setValue(get_smoothing_factor(self.session))
+        self.ui.spinBox.blockSignals(False)
+        self.replot()
+
     def replot(self):
         """
         Replot regular and smoothed curve, amplitude, peak and fwhm. 
@@ -452,7 +484,7 @@ class CustomPlot(QDialog):
 
         if self.ui.checkBox_sem.isChecked() and self.ui.stimuliBox.currentText() != "All":
             mean = self.session.get_mean()[self.ui.stimuliBox.currentText()]
-            x = np.arange(mean.size)*self.session.get_tr()
+            x = (np.arange(mean.size) - self.session.baseline)*self.session.get_tr()
             self.current_ax.relim()
             sem = self.session.get_sem()
             self.sem.append(self.current_ax.errorbar(x, mean, color=self.get_color(), yerr=sem[self.ui.stimuliBox.currentText()]))
@@ -501,12 +533,15 @@ class CustomPlot(QDialog):
     def __plot_amp(self, stimuli_val, position):
         self.amp.append(
                 self.current_ax.axhline(position[1], color=CustomPlot._colors[-1]))
+        # The amplitude is measured from the value when the stimuli starts,
+        # as in the exported results
         if self.ui.checkBox_smooth.isChecked():
-            start_value = self.session.get_smooth(self.ui.spinBox.value())[stimuli_val][0]
+            properties = self.session.get_response_properties(self.ui.spinBox.value())
+            amplitude = properties[stimuli_val]['amplitude']
         else:
-            start_value = self.session.get_mean()[stimuli_val][0]
+            amplitude = position[1] - self.session.get_mean()[stimuli_val][self.session.baseline]
         return "Amplitude " + stimuli_val + ": " + \
-                str(position[1] - start_value) + "\n"
+                str(amplitude) + "\n"
 
     def plot_peak(self):
         """
@@ -602,7 +637,7 @@ class CustomPlot(QDialog):
         """
         if self.ui.stimuliBox.currentText() == "All":
             for stimuli_type, stimuli_data in data_dict.iteritems():
-                x = np.arange(len(stimuli_data))*self.session.get_tr()
+                x = (np.arange(len(stimuli_data)) - self.session.baseline)*self.session.get_tr()
                 if name:
                     stimuli_type = name + " - " + stimuli_type
                 axis, = self.current_ax.plot(x, stimuli_data, color=self.get_color(), label=stimuli_type)
@@ -611,7 +646,7 @@ class CustomPlot(QDialog):
             type = self.ui.stimuliBox.currentText()
             if type in data_dict:
                 data = data_dict[type]
-                x = np.arange(len(data))*self.session.get_tr()
+                x = (np.arange(len(data)) - self.session.baseline)*self.session.get_tr()
                 if name:
                     type = name + " - " + type
                 axis, = self.current_ax.plot(x, data, color=self.get_color(), label=type)
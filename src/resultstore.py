@@ -0,0 +1,260 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Storage of the results of whole projects in a single file.
+
+Every project, group, individual and session which is ready for
+calculation is stored under a path which mirrors the tree, such as
+'project/group/individual/session'. Below the path of a node its results
+are stored by kind and stimuli value:
+
+    project/group/responses/60     Responses to the stimuli, one per row
+    project/group/mean/60          Mean of the responses
+    project/group/sem/60           Standard error of the mean
+    project/group/std/60           Standard deviation
+    project/group/count/60         Number of samples of every time frame
+    project/group/peaks/60         Time and amplitude of the peak
+    project/group/smooth_peaks/60  Peak of the smoothed mean
+    project/group/fwhm/60          Start and end of the FWHM
+    project/group/amplitude/60     Peak of the smoothed mean above its onset value
+    project/group/onset_latency/60 Time the smoothed mean starts to rise
+    project/group/time_to_peak/60  Time from the onset latency to the smoothed peak
+    project/group/x_axis           Time of every frame in seconds
+
+The results are written to an HDF5 file if the path ends with .h5 or .hdf5
+and h5py is installed, otherwise to a compressed NPZ file. Both formats
+are read one array at a time by `ResultsReader`.
+"""
+
+import json
+
+import numpy as np
+
+import smoothing
+from group import get_keys
+
+try:
+    import h5py     # Optional, only needed for HDF5 files
+    H5PY_AVAILABLE = True
+except ImportError:
+    H5PY_AVAILABLE = False
+
+
+# Key of the attributes of the nodes in NPZ files
+ATTRIBUTES_KEY = '__attributes__'
+
+# Kinds of results that are stored per stimuli value
+KINDS = ['responses', 'mean', 'sem', 'std', 'count', 'peaks', 'smooth_peaks', 'fwhm', 'amplitude',
+         'onset_latency', 'time_to_peak']
+
+
+def is_hdf5(path):
+    return path.endswith('.h5') or path.endswith('.hdf5')
+
+
+def get_node_results(node, factor=None):
+    """
+    Calculate the results of a node. Results which have already been
+    calculated by the node are reused.
+
+    :param factor: Smoothing factor used for the smoothed peaks and FWHM.
+    :return: A tuple with a dictionary with 'kind/stimuli' as keys and
+             arrays as values, and a dictionary with the attributes of the
+             node.
+    """
+    factor = smoothing.get_smoothing_factor(node, factor)
+    mean = node.get_mean()
+    sem = node.get_sem()
+
+    attributes = {'name': node.name, 'tr': node.get_tr(), 'baseline': node.baseline,
+                  'smoothing_factor': factor, 'smoothing_method': node.get_smoothing_method(),
+                  'percent': bool(node.get_setting('percent')),
+                  'global': bool(node.get_setting('global')), 'errors': []}
+    arrays = {}
+
+    for stimuli_type, data in mean.iteritems():
+        arrays['responses/' + stimuli_type] = node.responses[stimuli_type]
+        arrays['mean/' + stimuli_type] = data
+        arrays['sem/' + stimuli_type] = sem[stimuli_type]
+        arrays['std/' + stimuli_type] = node.std_responses[stimuli_type]
+        arrays['count/' + stimuli_type] = node.count_responses[stimuli_type]
+        arrays['x_axis'] = (np.arange(data.size) - node.baseline) * node.get_tr()
+
+    for stimuli_type, position in node.get_peaks().iteritems():
+        arrays['peaks/' + stimuli_type] = np.array(position, dtype=np.float64)
+
+    try:
+        properties = node.get_response_properties(factor)
+    except Exception as exc:
+        attributes['errors'].append(' '.join(str(arg) for arg in exc.args))
+    else:
+        for stimuli_type, values in properties.iteritems():
+            arrays['smooth_peaks/' + stimuli_type] = np.array(values['peak'], dtype=np.float64)
+            arrays['fwhm/' + stimuli_type] = np.array(values['fwhm'], dtype=np.float64)
+            for kind in ['amplitude', 'onset_latency', 'time_to_peak']:
+                arrays[kind + '/' + stimuli_type] = np.array(values[kind], dtype=np.float64)
+
+    return arrays, attributes
+
+
+def collect_results(node, path, factor=None):
+    """
+    Calculate the results of a node and all of its children.
+
+    :param path: Path of the node in the store.
+    :return: A list of (path, arrays, attributes) tuples, see `get_node_results`.
+    """
+    results = []
+
+    if node.ready_for_calculation():
+        arrays, attributes = get_node_results(node, factor)
+        results.append((path, arrays, attributes))
+
+    children = node.children + node.sessions
+    for child, key in zip(children, get_keys(children)):
+        results += collect_results(child, path + '/' + key, factor)
+
+    return results
+
+
+def save_results(path, projects, factor=None):
+    """
+    Calculate and write the results of every node in the projects to a
+    single file.
+
+    :param path: Path of the file, see the module documentation for the format.
+    :param projects: List of groups, one for every project.
+    :param factor: Smoothing factor, by default the one of the plot window.
+    :return: A list with the paths of the nodes that were written.
+    """
+    results = []
+    for project, key in zip(projects, get_keys(projects)):
+        results += collect_results(project, key, factor)
+
+    if is_hdf5(path):
+        write_hdf5(path, results)
+    else:
+        write_npz(path, results)
+
+    return [node_path for node_path, _, _ in results]
+
+
+def write_hdf5(path, results):
+    """ Write results from `collect_results` to an HDF5 file with compressed datasets. """
+    if not H5PY_AVAILABLE:
+        raise Exception("Export error", "h5py is needed to write HDF5 files")
+
+    with h5py.File(path, 'w') as f:
+        for node_path, arrays, attributes in results:
+            group = f.require_group(node_path)
+            for name, value in attributes.iteritems():
+                group.attrs[name] = json.dumps(value)
+            for name, array in arrays.iteritems():
+                array = np.asarray(array)
+                if array.size > 1:
+                    group.create_dataset(name, data=array, chunks=True, compression='gzip',
+                                         shuffle=True)
+                else:
+                    group.create_dataset(name, data=array)
+
+
+def write_npz(path, results):
+    """ Write results from `collect_results` to a compressed NPZ file. """
+    arrays = {}
+    attributes = {}
+    for node_path, node_arrays, node_attributes in results:
+        attributes[node_path] = node_attributes
+        for name, array in node_arrays.iteritems():
+            arrays[node_path + '/' + name] = array
+
+    arrays[ATTRIBUTES_KEY] = np.array(json.dumps(attributes))
+
+    # np.savez adds the extension if it is missing
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+class ResultsReader(object):
+    """
+    Reader of a file written by `save_results`. Arrays are only read from
+    the file when they are asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        if is_hdf5(path):
+            if not H5PY_AVAILABLE:
+                raise Exception("Import error", "h5py is needed to read HDF5 files")
+            self.file = h5py.File(path, 'r')
+            self.attributes = {}
+            self.file.visititems(self._add_node)
+        else:
+            self.file = np.load(path)
+            self.attributes = json.loads(str(self.file[ATTRIBUTES_KEY]))
+
+    def _add_node(self, name, item):
+        if isinstance(item, h5py.Group) and 'name' in item.attrs:
+            self.attributes[name] = dict((key, json.loads(value))
+                                         for key, value in item.attrs.iteritems())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_nodes(self):
+        """ Return the paths of the nodes in the file, parents before children. """
+        return sorted(self.attributes)
+
+    def get_attributes(self, node):
+        """ Return the name, tr, baseline, settings and errors of a node. """
+        return self.attributes[node]
+
+    def get_stimuli_types(self, node, kind='mean'):
+        """ Return the stimuli values a kind of results is stored for in a node. """
+        prefix = node + '/' + kind + '/'
+        if is_hdf5(self.path):
+            return sorted(self.file[prefix].keys()) if prefix[:-1] in self.file else []
+        return sorted(key[len(prefix):] for key in self.file.files if key.startswith(prefix))
+
+    def read(self, node, kind, stimuli_type=None):
+        """
+        Read results of a node.
+
+        :param node: Path of the node, see `get_nodes`.
+        :param kind: Kind of results, one of `KINDS` or 'x_axis'.
+        :param stimuli_type: Stimuli value to read, or None for all values.
+        :return: An array, or a dictionary with stimuli values as keys and
+                 arrays as values if no stimuli value is given.
+        """
+        if kind == 'x_axis':
+            return self._read(node + '/x_axis')
+        if stimuli_type is not None:
+            return self._read(node + '/' + kind + '/' + stimuli_type)
+        return dict((stimuli_type, self._read(node + '/' + kind + '/' + stimuli_type))
+                    for stimuli_type in self.get_stimuli_types(node, kind))
+
+    def _read(self, key):
+        if is_hdf5(self.path):
+            return self.file[key][()]
+        return self.file[key]
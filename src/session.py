@@ -17,7 +17,11 @@
 
 import numpy as np
 from src.brain import Brain
-from group import Group
+from src.mask import Mask
+from src.stimuli import Stimuli
+from group import Group, lazy_file
+from headers import read_header
+from instrumentation import profiler
 
 
 class Session(Group):
@@ -28,6 +32,11 @@ class Session(Group):
     data is stored in the member data
     """
 
+    # ROICache shared by all sessions, masked data is not cached if None
+    cache = None
+
+    brain = lazy_file('brain')
+
     def __init__(self, configuration=None):
         super(Session, self).__init__()
 
@@ -38,11 +47,17 @@ class Session(Group):
         self.used_mask = None
         self.used_stimuli = None
         self.used_tr = None  # Used because used stimuli is a pointer
+        self.used_baseline = None
+        self.used_interpolate = None
 
         if configuration:
             self.load_configuration(configuration)
 
     def load_configuration(self, configuration):
+        """
+        Load the settings of the session from a configuration. The files are
+        not opened until they are used, see `defer_loading`.
+        """
         if 'name' in configuration:
             self.name = configuration['name']
 
@@ -53,34 +68,34 @@ class Session(Group):
             self.plot_settings = configuration['plot_settings']
 
         if 'path' in configuration:
-            self.load_sequence(configuration['path'])
+            self.defer_loading('brain', {'path': configuration['path']})
 
         if 'anatomy_path' in configuration:
-            self.load_anatomy(configuration['anatomy_path'])
+            self.defer_loading('anatomy', {'path': configuration['anatomy_path']})
 
         if 'mask' in configuration:
-            self.load_mask(configuration['mask']['path'])
+            self.defer_loading('mask', configuration['mask'])
 
         if 'tr' in configuration:
             self.tr = configuration['tr']
 
         if 'stimuli' in configuration:
-            self.load_stimuli(configuration['stimuli']['path'])
+            self.defer_loading('stimuli', configuration['stimuli'])
 
     def get_configuration(self):
         configuration = {}
 
-        if self.brain:
-            configuration['path'] = self.brain.path
+        if self.has_file('brain'):
+            configuration['path'] = self.get_path('brain')
 
-        if self.anatomy:
-            configuration['anatomy_path'] = self.anatomy.path
+        if self.has_file('anatomy'):
+            configuration['anatomy_path'] = self.get_path('anatomy')
 
-        if self.mask:
-            configuration['mask'] = self.mask.get_configuration()
+        if self.has_file('mask'):
+            configuration['mask'] = self.get_file_configuration('mask')
 
-        if self.stimuli:
-            configuration['stimuli'] = self.stimuli.get_configuration()
+        if self.has_file('stimuli'):
+            configuration['stimuli'] = self.get_file_configuration('stimuli')
 
         if self.name:
             configuration['name'] = self.name
@@ -98,7 +113,8 @@ class Session(Group):
         return configuration
 
     def ready_for_calculation(self, mask=None, stimuli=None):
-        return self.brain is not None and \
+        # The sequence is not opened until the session is calculated
+        return self.can_open('brain') and \
                super(Session, self).ready_for_calculation(mask, stimuli)
 
     def settings_changed(self, percentage, global_, mask, stimuli):
@@ -115,7 +131,9 @@ class Session(Group):
                     self.did_global_normalization != global_,
                     self.used_mask != mask,
                     self.used_stimuli != stimuli]) or \
-            self.used_tr != stimuli.tr
+            self.used_tr != stimuli.tr or \
+            self.used_baseline != stimuli.baseline or \
+            self.used_interpolate != stimuli.interpolate
 
     def _aggregate(self, percentage, global_, mask, stimuli):
         """
@@ -132,56 +150,208 @@ class Session(Group):
         if not stimuli:
             stimuli = self.stimuli
 
-        # Save settings used
+        self.save_settings(percentage, global_, mask, stimuli)
+
+        node = self.get_tree_path()
+        with profiler.span('apply_mask', node):
+            self.apply_mask(mask)
+        with profiler.span('separate_into_responses', node):
+            self.separate_into_responses(stimuli)
+        with profiler.span('normalize', node):
+            self.normalize(percentage, global_)
+
+        return self.responses
+
+    def save_settings(self, percentage, global_, mask, stimuli):
+        """
+        Save the settings used for an aggregation and invalidate the results
+        calculated from the previous one.
+        """
         self.did_percent_normalization = percentage
         self.did_global_normalization = global_
         self.used_mask = mask
         self.used_stimuli = stimuli
         self.used_tr = stimuli.tr
+        self.used_baseline = stimuli.baseline
+        self.used_interpolate = stimuli.interpolate
+        self.baseline = stimuli.baseline
+
+        # The responses are about to change
+        self.version += 1
+        self.block = None
 
         # Invalidate cached mean and sem
         self.sem_responses = None
         self.mean_responses = None
+        self.std_responses = None
+        self.count_responses = None
         self.smoothed_responses = None
 
-        self.apply_mask(mask)
-        self.separate_into_responses(stimuli)
-        self.normalize(percentage, global_)
+    def set_responses(self, percentage, global_, mask, stimuli, masked_data, responses, x_axis):
+        """
+        Store the result of an aggregation calculated elsewhere, such as in
+        `calculate_responses`, as if `_aggregate` had been run with the
+        given settings.
+        """
+        self.save_settings(percentage, global_, mask, stimuli)
 
-        return self.responses
+        self.masked_data = masked_data
+        self.responses = responses
+        self.x_axis = x_axis
+
+    def get_sessions(self, mask=None, stimuli=None):
+        if not mask:
+            mask = self.mask
+        if not stimuli:
+            stimuli = self.stimuli
+
+        return [(self, mask, stimuli)]
 
     def separate_into_responses(self, stimuli):
-        number_of_stimuli = stimuli.amount
+        """
+        Separate the masked data into one response per stimuli and group
+        the responses by stimuli value in the member responses.
+
+        Every response is as long as the shortest interval between two
+        stimuli and starts `stimuli.baseline` images before the onset of
+        its stimuli. All responses are extracted at once with a matrix of
+        image indices. Responses that do not fit within the sequence and
+        the images after the last time stamp are ignored.
+
+        If `stimuli.interpolate` is set the responses start at the exact
+        onset times instead of at the image each onset falls within. The
+        masked data is then linearly interpolated at the fractional image
+        positions of all responses at once, so that responses to onsets
+        between two images are aligned before they are averaged.
+
+        :param stimuli: Stimuli object with the onsets of the responses
+        """
+        intensities = stimuli.data[:-1, 1]
+        series = self.masked_data[0]
 
-        shortest_interval = min([j - i for i, j in zip(stimuli.data[:-1, 0], stimuli.data[1:, 0])])
-        self.x_axis = np.array(list(range(shortest_interval))) * stimuli.tr
+        shortest_interval = np.min(np.diff(stimuli.data[:, 0]))
+        window = np.arange(-stimuli.baseline, shortest_interval)
+        self.x_axis = window * stimuli.tr
 
-        self.responses = {}
+        # Image positions of the responses, one row per stimuli
+        if stimuli.interpolate:
+            starts = stimuli.onset_times[:-1] / stimuli.tr - 1
+        else:
+            starts = stimuli.data[:-1, 0] - 1
+        positions = starts[:, np.newaxis] + window
+
+        valid = (positions[:, 0] >= 0) & (np.ceil(positions[:, -1]) < series.size)
+        positions = positions[valid]
+        intensities = intensities[valid]
+
+        if stimuli.interpolate:
+            lower = np.floor(positions).astype(np.intp)
+            upper = np.minimum(lower + 1, series.size - 1)
+            weight = positions - lower
+            epochs = series[lower] * (1 - weight) + series[upper] * weight
+        else:
+            epochs = series[positions]
 
-        # Ignore the images after the last time stamp
-        for i in range(number_of_stimuli - 1):
-            start = stimuli.data[i, 0]
-            end = start + shortest_interval
-            response = self.masked_data[:, (start - 1):(end - 1)]
-            intensity = str(stimuli.data[i, 1])
-            if intensity in self.responses:
-                self.responses[intensity] = np.concatenate((self.responses[intensity], response))
-            else:
-                self.responses[intensity] = response
+        # Sort the responses by intensity, keeping the order of the stimuli
+        order = np.argsort(intensities, kind='mergesort')
+        epochs = epochs[order]
+        values, starts = np.unique(intensities[order], return_index=True)
+
+        self.responses = {}
+        for value, response in zip(values, np.split(epochs, starts[1:])):
+            self.responses[str(value)] = response
 
     def apply_mask(self, mask):
         """
         Apply the given mask to the brain and save the data for further
         calculations in the member masked_data.
 
+        The whole voxels x time block of the ROI is gathered from the
+        sequence in a single indexing operation using the voxel indices of
+        the mask. Only the bounding box of the ROI is read from the
+        sequence. Voxels which are zero after masking are excluded from the
+        mean.
+
+        If `Session.cache` is set the masked data is read from the cache
+        when the same sequence and mask have been used before. Masks taken
+        from an atlas share its file and are therefore not cached.
+
         :param mask: Mask object which should be applied
         """
-        self.masked_data = np.zeros((1, self.brain.images))
+        use_cache = self.cache and mask.label is None
+
+        if use_cache:
+            self.masked_data = self.cache.load(self.brain.path, mask.path)
+            if self.masked_data is not None:
+                return
+
+        box = mask.bounding_box
+        block = self.brain.get_block(*box)
+
+        self.masked_data = get_roi_mean(block, box, mask).reshape((1, self.brain.images))
+
+        if use_cache:
+            self.cache.store(self.brain.path, mask.path, self.masked_data)
+
+    def apply_masks(self, masks):
+        """
+        Apply several masks to the brain with a single read of the sequence.
+
+        The block covering the bounding boxes of all ROIs is read in chunks
+        of consecutive images of at most `Brain.slab_size` bytes, and the
+        mean time series of every ROI is gathered from each chunk. The
+        result is returned and the member masked_data is left untouched.
+
+        :param masks: List of Mask objects, for instance from Mask.get_labels
+        :return: A ROIs x images matrix with the mean time series of each ROI.
+        """
+        boxes = [mask.bounding_box for mask in masks if mask.count]
+        if boxes:
+            box = tuple(slice(min(axis.start for axis in axes), max(axis.stop for axis in axes))
+                        for axes in zip(*boxes))
+        else:
+            box = (slice(0, 0),) * 3
+
+        images = self.brain.images
+        step = self.brain.get_slab_images(int(np.prod([axis.stop - axis.start for axis in box])))
+
+        masked_data = np.zeros((len(masks), images))
+        for start in xrange(0, images, step):
+            chunk = slice(start, min(start + step, images))
+            block = self.brain.get_block(*box, images=chunk)
+            for row, mask in enumerate(masks):
+                masked_data[row, chunk] = get_roi_mean(block, box, mask)
+
+        return masked_data
+
+    def calculate_roi_responses(self, masks, percentage, global_, stimuli=None):
+        """
+        Extract, separate and normalize the responses of several ROIs, with
+        the sequence read once for all of them.
 
-        for i in range(self.brain.images):
-            visual_brain = mask.data * self.brain.sequence[:, :, :, i]
-            visual_brain_time = np.nonzero(visual_brain)
-            self.masked_data[:, i] = np.mean(visual_brain[visual_brain_time])
+        The results of the regular aggregation of the session are not
+        changed.
+
+        :param masks: List of Mask objects, for instance from Mask.get_labels
+        :param stimuli: Stimuli to use instead of the stimuli of the session
+        :return: A list with the responses of every mask, in the same format
+                 as the member responses.
+        """
+        if not stimuli:
+            stimuli = self.stimuli
+
+        roi_session = Session()
+        roi_session.brain = self.brain
+        roi_session.baseline = stimuli.baseline
+
+        roi_responses = []
+        for masked_data in self.apply_masks(masks):
+            roi_session.masked_data = masked_data[np.newaxis, :]
+            roi_session.separate_into_responses(stimuli)
+            roi_session.normalize(percentage, global_)
+            roi_responses.append(roi_session.responses)
+
+        return roi_responses
 
     def normalize(self, percentage, global_):
         """
@@ -192,18 +362,20 @@ class Session(Group):
         :param percentage: Whether percentual change from reference value should be shown.
         If false, the response will be normalized by subtraction of the reference value.
         :param global_: Whether reference value should be the global mean.
-        If false, reference value will be the start value of the response
+        If false, reference value will be the start value of the response,
+        or the mean of the images before the onset if the responses include
+        a baseline.
         """
         if global_:
-            ref = np.sum(self.brain.sequence, (0, 1, 2, 3))     # Sum of all dimensions
-            number_of_samples = np.nonzero(self.brain.sequence)[0].size     # Count the coordinates
-            ref = ref / number_of_samples
+            global_mean = self.brain.get_global_mean()
 
         for key in self.responses.keys():
             number_of_stimuli = self.responses[key].shape[0]
 
             if global_:
-                ref = np.ones(number_of_stimuli) * ref
+                ref = np.ones(number_of_stimuli) * global_mean
+            elif self.baseline:
+                ref = np.mean(self.responses[key][:, 0:self.baseline], axis=1)
             else:
                 ref = self.responses[key][:, 0]
             for i in range(number_of_stimuli):
@@ -212,20 +384,94 @@ class Session(Group):
                 else:
                     self.responses[key][i, :] = self.responses[key][i, :] - ref[i]
 
-    def load_sequence(self, path):
-        """ Load the sequence from the path. Returns an error message if something went wrong, otherwise None """
+    def check_sequence(self, path):
+        """ Check a sequence by its header. Returns an error message if it can not be opened, otherwise None """
         try:
-            temp_brain = Brain(path)
+            header = read_header(path)
         except IOError:
             return path + " does not exist"
         except:
             return path + " could not be opened. It might be corrupted"
-        if len(temp_brain.shape) != 4:
-            return "The data has " + str(len(temp_brain.shape)) + " dimensions instead of 4"
-        elif self.mask and self.mask.shape != temp_brain.shape[0:3]:
+        mask_header = self.get_header('mask')
+        if len(header.shape) != 4:
+            return "The data has " + str(len(header.shape)) + " dimensions instead of 4"
+        elif mask_header and mask_header.shape != header.shape[0:3]:
             return "The EPI sequence is not the same size as the mask"
-        elif self.stimuli and self.stimuli.data[-1,0] > temp_brain.images:
+        elif self.stimuli and self.stimuli.data[-1,0] > header.shape[3]:
             return "The EPI sequence is too short compared to the times in the stimuli file"
-        else:
-            self.brain = temp_brain
-            return None
+        return None
+
+    def load_sequence(self, path):
+        """ Load the sequence from the path. Returns an error message if something went wrong, otherwise None """
+        error = self.check_sequence(path)
+        if error:
+            return error
+        self.brain = Brain(path)
+        return None
+
+
+def get_roi_mean(block, box, mask):
+    """
+    Calculate the mean time series of the voxels of a ROI, weighted with
+    the values of the mask. Voxels which are zero after masking are
+    excluded from the mean.
+
+    :param block: Block of the sequence covering the ROI.
+    :param box: Tuple with the slices of the sequence the block was read from.
+    :param mask: Mask object with the ROI.
+    :return: Vector with one value per image.
+    """
+    roi = mask.get_coordinates()
+    local_roi = tuple(axis - axis_box.start for axis, axis_box in zip(roi, box))
+
+    # Voxels x time matrix weighted with the mask values
+    voxels = block[local_roi]
+    if mask.weights is not None:
+        voxels = voxels * mask.weights[:, np.newaxis]
+
+    samples = np.count_nonzero(voxels, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sum(voxels, axis=0, dtype=np.float64) / samples
+
+
+def calculate_responses(arguments):
+    """
+    Extract, separate and normalize the responses of a session from its
+    files. Used by `Group.aggregate_sessions` to aggregate sessions in
+    worker processes.
+
+    :param arguments: Tuple with the path to the sequence, mask and stimuli,
+                      the tr, baseline and interpolation of the stimuli, the
+                      normalization settings, the ROICache and VolumeCache
+                      to use and the path of the session in the tree,
+                      which its spans are recorded for.
+    :return: Tuple with the masked data, the responses, the x axis and the
+             spans recorded while calculating them.
+    """
+    brain_path, mask_path, stimuli_path, tr, baseline, interpolate, percentage, global_, cache, \
+        volume_cache, name = arguments
+
+    Session.cache = cache
+    Brain.volume_cache = volume_cache
+
+    stimuli = Stimuli(stimuli_path, tr)
+    stimuli.baseline = baseline
+    stimuli.interpolate = interpolate
+
+    # Only return the spans of this session, worker processes are reused
+    profiler.clear()
+
+    session = Session()
+    session.name = name
+    session.baseline = baseline
+
+    with profiler.span('aggregate', name):
+        session.brain = Brain(brain_path)
+        with profiler.span('apply_mask'):
+            session.apply_mask(Mask(mask_path))
+        with profiler.span('separate_into_responses'):
+            session.separate_into_responses(stimuli)
+        with profiler.span('normalize'):
+            session.normalize(percentage, global_)
+
+    return session.masked_data, session.responses, session.x_axis, profiler.spans
@@ -0,0 +1,167 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Smoothing of the mean responses.
+
+Two methods are available:
+
+'spline'     A smoothing spline of degree 4 is fitted to every curve, where
+             the factor bounds the sum of squared residuals. This is the
+             default and the method the application has always used.
+'whittaker'  Whittaker-Henderson smoothing, a discrete smoothing spline
+             where the factor weighs the squared second differences of the
+             curve against the residuals. It is a linear operator, so all
+             curves of the same length are smoothed at once with a single
+             matrix product.
+
+Both return the smoothed samples of the curves. Splines through the
+smoothed samples, which are needed to find peaks and crossings between
+the samples, are only created when asked for.
+
+'spline' stays the default so that saved configurations give the same
+results as before. Its knots are chosen for every curve on its own, so
+the curves are fitted one at a time. The method and factor of a node can
+be chosen in the plot window and are saved in its plot settings.
+
+The factors of the methods are different quantities and have their own
+defaults, see `get_default_factor`.
+"""
+
+import numpy as np
+from scipy.interpolate import InterpolatedUnivariateSpline, UnivariateSpline
+
+METHODS = ['spline', 'whittaker']
+
+# Method used for nodes without a saved method
+DEFAULT_METHOD = 'spline'
+
+# Degree of the splines, the derivative has to be cubic to find its roots
+DEGREE = 4
+
+# Whittaker operators by length and factor
+_operators = {}
+_max_operators = 32
+
+
+def check_size(size):
+    if size <= DEGREE:
+        raise Exception("Smoothing error", "Not enough data points for smoothing")
+
+
+def get_default_factor(method, percent):
+    """
+    Return the smoothing factor a method starts with.
+
+    The factor of a spline bounds the sum of squared residuals, so it
+    depends on the scale of the responses. 2 suits responses normalized
+    to percent and 20 suits the raw signal. Whittaker smoothing is linear,
+    so its factor weighs the roughness against the residuals whatever the
+    scale, and the same default suits both.
+
+    :param method: One of `METHODS`.
+    :param percent: Whether the responses are normalized to percent.
+    """
+    if method == 'whittaker':
+        return 10
+    return 2 if percent else 20
+
+
+def get_smoothing_factor(node, factor=None):
+    """
+    Return the smoothing factor the plot window would start with. This is
+    the factor last used in the plot window for the method the node is
+    smoothed with, which is saved in the plot settings of the node.
+    Otherwise it is the default of the method, see
+    `get_default_factor`.
+
+    :param factor: Factor to use instead, returned as it is if not None.
+    """
+    if factor is not None:
+        return factor
+    method = node.get_smoothing_method()
+    factors = node.get_setting('smoothing_factors') or {}
+    if method in factors:
+        return factors[method]
+    return get_default_factor(method, node.get_setting('percent'))
+
+
+def get_whittaker_operator(size, factor):
+    """
+    Return the matrix which smooths a curve of the given length.
+
+    The smoothed curve z of y minimizes |y - z|^2 + factor * |D z|^2 where
+    D takes the second differences, so z = (I + factor * D'D)^-1 y. The
+    matrices are cached since the same lengths and factors are used for
+    every node.
+    """
+    key = (size, float(factor))
+    if key not in _operators:
+        if len(_operators) >= _max_operators:
+            _operators.clear()
+        difference = np.diff(np.eye(size), 2, axis=0)
+        penalty = np.eye(size) + factor * difference.T.dot(difference)
+        _operators[key] = np.linalg.inv(penalty)
+    return _operators[key]
+
+
+def smooth_curves(x, curves, factor, method='spline'):
+    """
+    Smooth curves sampled at the same positions.
+
+    :param x: Positions of the samples.
+    :param curves: Dictionary with stimuli values as keys and curves as values.
+    :param factor: Smoothing factor, see the module documentation.
+    :param method: One of `METHODS`.
+    :return: A tuple with a dictionary with the smoothed samples of every
+             curve, and a dictionary with the fitted splines if the method
+             fits splines, otherwise None.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown smoothing method " + str(method))
+
+    keys = list(curves.keys())
+    if not keys:
+        return {}, None
+    check_size(len(x))
+
+    if method == 'whittaker':
+        # All curves of a node have the same length
+        matrix = np.vstack([curves[key] for key in keys])
+        smoothed = matrix.dot(get_whittaker_operator(len(x), factor).T)
+        return dict(zip(keys, smoothed)), None
+
+    splines = {}
+    for key in keys:
+        try:
+            splines[key] = UnivariateSpline(x, curves[key], k=DEGREE, s=factor)
+        except Exception:
+            raise Exception("Smoothing error", "Not enough data points for smoothing")
+    return dict((key, spline(x)) for key, spline in splines.iteritems()), splines
+
+
+def interpolate_curves(x, curves):
+    """
+    Return splines through the samples of smoothed curves, which can be
+    evaluated between the samples and differentiated.
+
+    :param curves: Dictionary with stimuli values as keys and curves as values.
+    :return: Dictionary with stimuli values as keys and splines as values.
+    """
+    check_size(len(x))
+    return dict((key, InterpolatedUnivariateSpline(x, curve, k=DEGREE))
+                for key, curve in curves.iteritems())
@@ -16,37 +16,77 @@
 # along with JABE.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
-import scipy
+import scipy.io
 
 
-class Stimuli:
+class Stimuli(object):
     """
     Class used for representing Stimuli Onset data
 
     The stimuli is read from a .mat file. The data can be accessed through
     the member called data.
     """
-    def __init__(self, path):
+    def __init__(self, path, tr=0.5):
+        """
+        :param path: Path to the .mat file with the stimuli onsets.
+        :param tr: Time between two images, used to convert the onset times
+                   to image indices.
+        """
         self.path = path
-        self.tr = 0.5
+        self._tr = tr
+        self._data = None
+        # Number of images before each onset included in the responses
+        self.baseline = 0
+        # Whether the responses are interpolated at the exact onset times
+        # instead of starting at the image the onset falls within
+        self.interpolate = False
         self.stimuli_onset_file = scipy.io.loadmat(path)
         self.stimuli_onset = self.stimuli_onset_file['visual_stimuli']
         self.amount = self.stimuli_onset.shape[0]
 
+        # Onset times in seconds and the value of every stimuli
+        self.onset_times = np.asarray(self.stimuli_onset[:, 0], dtype=np.float64)
+        self.values = np.asarray(self.stimuli_onset[:, 1]).astype(np.int32)  # TODO: Ensure value field always integer
+
+    @property
+    def tr(self):
+        return self._tr
+
+    @tr.setter
+    def tr(self, tr):
+        if tr != self._tr:
+            self._data = None
+        self._tr = tr
+
     @property
     def data(self):
-        data = np.zeros((self.stimuli_onset.shape[0], self.stimuli_onset.shape[1]))
+        """
+        Nx2 int32 matrix with the image index of the onset and the value of
+        every stimuli. It is calculated the first time it is read after the
+        tr has been set, and must not be modified.
+        """
+        if self._data is None:
+            data = np.empty((self.amount, 2), dtype=np.int32)
 
-        # Convert time stamps to image indices
-        data[:, 0] = np.floor(self.stimuli_onset[:, 0] / self.tr)
+            # Convert time stamps to image indices
+            data[:, 0] = np.floor(self.onset_times / self._tr)
+            data[:, 1] = self.values
 
-        data[:, 1] = self.stimuli_onset[:, 1]
-        data = data.astype(int)  # TODO: Ensure value field always integer
+            data.flags.writeable = False
+            self._data = data
 
-        return data
+        return self._data
 
     def get_configuration(self):
-        return {
+        configuration = {
             'path': self.path,
             'tr': self.tr
         }
+
+        if self.baseline:
+            configuration['baseline'] = self.baseline
+
+        if self.interpolate:
+            configuration['interpolate'] = self.interpolate
+
+        return configuration
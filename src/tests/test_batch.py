@@ -0,0 +1,130 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import nibabel as nib
+import numpy as np
+import scipy.io
+from src.batch import create_group, get_directory_names, main, write_results
+from src.session import Session
+
+
+class TestBatch(unittest.TestCase):
+
+    configuration = {
+        'name': 'project',
+        'groups': [{
+            'name': 'group',
+            'groups': [{
+                'name': 'individual',
+                'sessions': [{
+                    'name': 'session',
+                    'path': 'src/tests/test-data/brain.nii',
+                    'mask': {'path': 'src/tests/test-data/mask.nii'},
+                    'tr': 1,
+                    'stimuli': {'path': 'src/tests/test-data/stimuli.mat', 'tr': 1}
+                }]
+            }]
+        }]
+    }
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_create_group(self):
+        project = create_group(self.configuration)
+
+        self.assertEqual('project', project.name)
+        self.assertEqual('group', project.children[0].name)
+        self.assertEqual('individual', project.children[0].children[0].name)
+
+        session = project.children[0].children[0].sessions[0]
+        self.assertIsInstance(session, Session)
+        self.assertEqual('src/tests/test-data/brain.nii', session.brain.path)
+        self.assertTrue(project.ready_for_calculation())
+
+    def test_write_results(self):
+        project = create_group(self.configuration)
+        summaries = write_results(project, self.directory)
+
+        self.assertEqual(4, len(summaries))
+
+        session_directory = os.path.join(self.directory, 'group', 'individual', 'session')
+        results = scipy.io.loadmat(os.path.join(session_directory, 'results.mat'))
+        self.assertIn('mean_60', results)
+        self.assertIn('sem_60', results)
+
+    def test_duplicate_names(self):
+        configuration = copy.deepcopy(self.configuration)
+        sessions = configuration['groups'][0]['groups'][0]['sessions']
+        sessions.append(dict(sessions[0]))
+        project = create_group(configuration)
+
+        individual = project.children[0].children[0]
+        self.assertEqual(['session', 'session_2'], get_directory_names(individual.sessions))
+
+        summaries = write_results(project, self.directory)
+        self.assertEqual(5, len(summaries))
+        individual_directory = os.path.join(self.directory, 'group', 'individual')
+        for name in ['session', 'session_2']:
+            self.assertTrue(os.path.isfile(os.path.join(individual_directory, name, 'results.mat')))
+
+    def test_atlas(self):
+        atlas_data = np.zeros((32, 32, 5))
+        atlas_data[2:5, 3:9, 1] = 1
+        atlas_data[20:30, 10:12, 2:4] = 2
+        atlas = os.path.join(self.directory, 'atlas.nii')
+        nib.save(nib.Nifti1Image(atlas_data, np.eye(4)), atlas)
+
+        path = os.path.join(self.directory, 'configuration.json')
+        output = os.path.join(self.directory, 'results')
+        with open(path, 'w') as f:
+            json.dump({'project': [self.configuration]}, f)
+        main([path, output, '--atlas', atlas])
+
+        session_directory = os.path.join(output, 'project', 'group', 'individual', 'session')
+        rois = scipy.io.loadmat(os.path.join(session_directory, 'rois.mat'))
+        self.assertTrue(np.array_equal([[1, 2]], rois['labels']))
+        self.assertIn('mean_roi1_60', rois)
+        self.assertIn('sem_roi2_60', rois)
+        self.assertFalse(os.path.isfile(os.path.join(output, 'project', 'rois.mat')))
+
+    def test_exit_code(self):
+        path = os.path.join(self.directory, 'configuration.json')
+        output = os.path.join(self.directory, 'results')
+
+        with open(path, 'w') as f:
+            json.dump({'project': [{'name': 'empty'}]}, f)
+        self.assertEqual(0, main([path, output]))
+
+        # The responses of the test data are too short to be smoothed
+        with open(path, 'w') as f:
+            json.dump({'project': [self.configuration]}, f)
+        self.assertEqual(1, main([path, output]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.benchmark import main
+from src.stimuli import Stimuli
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_main(self):
+        output = os.path.join(self.directory, 'benchmark.json')
+        data = os.path.join(self.directory, 'data')
+        main([output, '--shape', '16', '16', '8', '--images', '60', '--radius', '3',
+              '--sessions', '2', '--repeat', '1', '--data', data])
+
+        with open(output, 'r') as f:
+            report = json.load(f)
+
+        self.assertIn('apply_mask', report['results'])
+        self.assertIn('get_fwhm', report['results'])
+        self.assertEqual(1, report['results']['normalize']['repeat'])
+
+        stimuli = Stimuli(os.path.join(data, 'stimuli.mat'))
+        self.assertEqual([1, 21], list(stimuli.data[:, 0]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
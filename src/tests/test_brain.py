@@ -15,8 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with JABE.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
+import tempfile
 import unittest
 import mock
+import nibabel
+import numpy as np
 from src.brain import Brain
 
 
@@ -31,6 +36,44 @@ class TestBrain(unittest.TestCase):
         ref = Brain('src/tests/test-data/brain.nii')
         self.assertEqual((1.0, 1.0, 1.0, 1.0), ref.get_voxel_size())
 
+    def test_get_volume(self):
+        ref = Brain('src/tests/test-data/brain.nii')
+        volume = ref.get_volume(3)
+
+        self.assertEqual((32, 32, 5), volume.shape)
+        self.assertTrue(np.array_equal(ref.sequence[:, :, :, 3], volume))
+
+    def test_get_block(self):
+        ref = Brain('src/tests/test-data/brain.nii', mmap=False)
+        block = ref.get_block(slice(2, 6), slice(0, 3), slice(1, 2))
+
+        self.assertEqual((4, 3, 1, 20), block.shape)
+        self.assertTrue(np.array_equal(ref.sequence[2:6, 0:3, 1:2, :], block))
+
+    def test_get_global_mean(self):
+        ref = Brain('src/tests/test-data/brain.nii')
+        sequence = ref.sequence
+        expected = np.sum(sequence) / np.count_nonzero(sequence)
+
+        self.assertAlmostEqual(expected, ref.get_global_mean())
+        self.assertEqual(np.count_nonzero(sequence), ref.global_samples)
+
+    def test_get_global_mean_compressed(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'brain.nii.gz')
+            nibabel.save(nibabel.load('src/tests/test-data/brain.nii'), path)
+            sequence = Brain('src/tests/test-data/brain.nii').sequence
+
+            ref = Brain(path)
+            # Read the volumes in slabs of three volumes and a partial slab
+            with mock.patch.object(Brain, 'slab_size', 3 * 32 * 32 * 5 * sequence.dtype.itemsize):
+                self.assertAlmostEqual(np.sum(sequence) / np.count_nonzero(sequence),
+                                       ref.get_global_mean())
+            self.assertEqual(np.count_nonzero(sequence), ref.global_samples)
+        finally:
+            shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,82 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.io
+from src.batch import create_group
+from src.bulkexport import ExportCancelled, FORMATS, export_projects
+from src.tests import test_batch
+
+
+class TestBulkExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.project = create_group(test_batch.TestBatch.configuration)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export_projects(self):
+        progress = []
+        manifest = export_projects([self.project], self.directory, 'mat',
+                                   progress=lambda done, total, path: progress.append((done, total)))
+
+        self.assertEqual([(1, 4), (2, 4), (3, 4), (4, 4)], progress)
+        self.assertEqual(['project', 'project/group', 'project/group/individual',
+                          'project/group/individual/session'],
+                         [node['path'] for node in manifest['nodes']])
+
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            self.assertEqual(manifest, json.load(f))
+
+        session = self.project.children[0].children[0].sessions[0]
+        session_directory = os.path.join(self.directory, 'project', 'group', 'individual', 'session')
+        results = scipy.io.loadmat(os.path.join(session_directory, 'results.mat'))
+        self.assertTrue(np.allclose(session.mean_responses['60'], results['mean_60']))
+        self.assertIn('60', manifest['nodes'][3]['peaks'])
+
+    def test_formats(self):
+        for format_ in FORMATS:
+            directory = os.path.join(self.directory, format_)
+            manifest = export_projects([self.project], directory, format_)
+            for node in manifest['nodes']:
+                for name in node['files']:
+                    self.assertTrue(os.path.isfile(os.path.join(directory, node['directory'], name)))
+
+        session = self.project.children[0].children[0].sessions[0]
+        table = np.genfromtxt(os.path.join(self.directory, 'csv', 'project', 'group', 'individual',
+                                           'session', 'results.csv'), delimiter=',', names=True)
+        self.assertTrue(np.allclose(session.mean_responses['60'], table['mean_60']))
+
+    def test_cancel(self):
+        def cancel(done, total, path):
+            raise ExportCancelled()
+
+        self.assertRaises(ExportCancelled, export_projects, [self.project], self.directory,
+                          progress=cancel)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'manifest.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import nibabel
+import numpy as np
+from src.brain import Brain
+from src.cache import ROICache, VolumeCache
+
+
+class TestROICache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_and_load(self):
+        ref = ROICache(self.directory)
+        data = np.arange(20, dtype=np.float64).reshape((1, 20))
+
+        self.assertIsNone(ref.load('src/tests/test-data/brain.nii', 'src/tests/test-data/mask.nii'))
+
+        ref.store('src/tests/test-data/brain.nii', 'src/tests/test-data/mask.nii', data)
+        loaded = ROICache(self.directory).load('src/tests/test-data/brain.nii', 'src/tests/test-data/mask.nii')
+
+        self.assertTrue(np.array_equal(data, loaded))
+
+    def test_evict(self):
+        ref = ROICache(self.directory, max_size=0)
+        data = np.zeros((1, 20))
+
+        ref.store('src/tests/test-data/brain.nii', 'src/tests/test-data/mask.nii', data)
+        ref.store('src/tests/test-data/mask.nii', 'src/tests/test-data/brain.nii', data)
+
+        self.assertIsNone(ref.load('src/tests/test-data/brain.nii', 'src/tests/test-data/mask.nii'))
+        self.assertIsNotNone(ref.load('src/tests/test-data/mask.nii', 'src/tests/test-data/brain.nii'))
+
+
+
+class TestVolumeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'brain.nii.gz')
+        nibabel.save(nibabel.load('src/tests/test-data/brain.nii'), self.path)
+
+    def tearDown(self):
+        Brain.volume_cache = None
+        shutil.rmtree(self.directory)
+
+    def test_get(self):
+        ref = VolumeCache(os.path.join(self.directory, 'cache'))
+
+        cached_path = ref.get(self.path)
+        self.assertTrue(cached_path.endswith('.nii'))
+        self.assertTrue(np.array_equal(nibabel.load(self.path).get_data(),
+                                       nibabel.load(cached_path).get_data()))
+
+        # The file is only decompressed once
+        with mock.patch('src.cache.gzip.open') as mock_open:
+            self.assertEqual(cached_path, ref.get(self.path))
+            self.assertFalse(mock_open.called)
+
+        # Uncompressed files are not cached
+        self.assertEqual('src/tests/test-data/brain.nii', ref.get('src/tests/test-data/brain.nii'))
+
+        Brain.volume_cache = ref
+        brain = Brain(self.path)
+        self.assertEqual(self.path, brain.path)
+        self.assertEqual((32, 32, 5, 20), brain.shape)
+
+    def test_evict(self):
+        ref = VolumeCache(os.path.join(self.directory, 'cache'), max_size=0)
+        other_path = os.path.join(self.directory, 'mask.nii.gz')
+        nibabel.save(nibabel.load('src/tests/test-data/mask.nii'), other_path)
+
+        cached_path = ref.get(self.path)
+        other_cached_path = ref.get(other_path)
+
+        self.assertFalse(os.path.exists(cached_path))
+        self.assertTrue(os.path.exists(other_cached_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
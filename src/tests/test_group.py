@@ -18,7 +18,8 @@
 import unittest
 import mock
 import numpy as np
-from src.group import Group
+import scipy.stats
+from src.group import Group, make_unique, masked_statistics, merge_blocks
 from src.session import Session
 
 
@@ -59,6 +60,78 @@ class TestGroup(unittest.TestCase):
         mock_sett_change.assert_called_once_with(ref, None, None, None, None)
         mock_aggr.assert_called_once_with(ref, None, None, None, None)
 
+    def test_aggregate_sessions(self):
+        def create_group(workers):
+            group = Group()
+            group.workers = workers
+            for i in range(3):
+                child = Session()
+                child.load_sequence('src/tests/test-data/brain.nii')
+                child.load_mask('src/tests/test-data/mask.nii')
+                child.load_stimuli('src/tests/test-data/stimuli.mat')
+                group.add_session(child)
+            return group
+
+        serial = create_group(1).aggregate(True, False)
+        parallel = create_group(2).aggregate(True, False)
+
+        self.assertEqual(sorted(serial.keys()), sorted(parallel.keys()))
+        for intensity in serial:
+            self.assertTrue(np.array_equal(serial[intensity], parallel[intensity]))
+
+    def test_incremental_aggregation(self):
+        def create_session(baseline):
+            child = Session()
+            child.load_sequence('src/tests/test-data/brain.nii')
+            child.load_mask('src/tests/test-data/mask.nii')
+            child.load_stimuli('src/tests/test-data/stimuli.mat')
+            child.stimuli.baseline = baseline
+            return child
+
+        individual = Group()
+        individual.add_session(create_session(0))
+        individual.add_session(create_session(1))
+        ref = Group()
+        ref.add_child(individual)
+        ref.add_session(create_session(0))
+
+        def check_statistics():
+            mean, sem, std, count = masked_statistics(ref.aggregate(False, False)['200'])
+            ref.calculate_statistics(False, False, None, None)
+            self.assertTrue(np.allclose(mean, ref.mean_responses['200']))
+            self.assertTrue(np.allclose(std, ref.std_responses['200'], equal_nan=True))
+            self.assertTrue(np.array_equal(count, ref.count_responses['200']))
+
+        check_statistics()
+
+        # Only the added session is aggregated
+        added = create_session(0)
+        ref.add_session(added)
+        self.assertTrue(ref.settings_changed(False, False, None, None))
+        with mock.patch.object(Session, 'apply_mask', autospec=True,
+                               side_effect=Session.apply_mask) as apply_mask:
+            check_statistics()
+        apply_mask.assert_called_once_with(added, added.mask)
+
+        ref.remove_session(added)
+        self.assertTrue(ref.settings_changed(False, False, None, None))
+        check_statistics()
+        self.assertFalse(ref.settings_changed(False, False, None, None))
+
+        # The statistics do not concatenate the responses, and only the block
+        # of the added session is merged into the block of the group
+        ref.add_session(added)
+        with mock.patch('src.group.concatenate_responses') as concatenate, \
+                mock.patch('src.group.merge_blocks', side_effect=merge_blocks) as merge:
+            ref.calculate_statistics(False, False, None, None)
+        self.assertFalse(concatenate.called)
+        self.assertEqual(2, len(merge.call_args[0][0]))
+        check_statistics()
+
+    def test_make_unique(self):
+        self.assertEqual(['a', 'b', 'a_3', 'A_4', 'a_3_5'],
+                         make_unique(['a', 'b', 'a', 'A', 'a_3']))
+
     def test_add_children(self):
         ref = Group()
         child1 = Session()
@@ -92,6 +165,21 @@ class TestGroup(unittest.TestCase):
         self.assertEqual(ref.description, 'test_desc')
         self.assertEqual(ref.plot_settings, 'test_settings')
 
+    def test_masked_statistics(self):
+        data = np.array([[1.0, 0.0, 2.0, 0.0],
+                         [3.0, 0.0, 0.0, 0.0],
+                         [8.0, 5.0, 4.0, 0.0]])
+
+        mean, sem, std, count = masked_statistics(data)
+
+        self.assertTrue(np.allclose([4.0, 5.0, 3.0, 0.0], mean))
+        self.assertTrue(np.array_equal([3, 1, 2, 0], count))
+        self.assertAlmostEqual(scipy.stats.sem([1.0, 3.0, 8.0], ddof=1), sem[0])
+        self.assertAlmostEqual(scipy.stats.sem([2.0, 4.0], ddof=1), sem[2])
+        self.assertAlmostEqual(np.std([1.0, 3.0, 8.0], ddof=1), std[0])
+        self.assertTrue(np.isnan(sem[1]))
+        self.assertEqual(0, sem[3])
+
     def test_calculate_amplitude(self):
         fn = lambda x: -x ** 2 + 20 * x
         test_y = [fn(x) for x in range(21)]
@@ -0,0 +1,58 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import nibabel
+from src.headers import read_header, clear_headers
+
+
+class TestHeaders(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'brain.nii')
+        shutil.copy('src/tests/test-data/brain.nii', self.path)
+        clear_headers()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        clear_headers()
+
+    def test_read_header(self):
+        with mock.patch('src.headers.nibabel.load', side_effect=nibabel.load) as mock_load:
+            header = read_header(self.path)
+            self.assertEqual((32, 32, 5, 20), header.shape)
+            self.assertEqual((1.0, 1.0, 1.0, 1.0), header.zooms)
+
+            # The header is only read again when the file has changed
+            self.assertIs(header, read_header(self.path))
+            self.assertEqual(1, mock_load.call_count)
+
+            mtime = os.stat(self.path).st_mtime
+            os.utime(self.path, (mtime + 10, mtime + 10))
+            read_header(self.path)
+            self.assertEqual(2, mock_load.call_count)
+
+        self.assertRaises(IOError, read_header, os.path.join(self.directory, 'missing.nii'))
+
+if __name__ == '__main__':
+    unittest.main()
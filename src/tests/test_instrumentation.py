@@ -0,0 +1,111 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from src.batch import create_group
+from src.brain import Brain
+from src.instrumentation import Profiler, profiler
+from src.tests import test_batch
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_span(self):
+        ref = Profiler()
+
+        with ref.span('aggregate', 'session'):
+            with ref.span('apply_mask'):
+                ref.add_bytes_read(100)
+            with ref.span('normalize', 'other'):
+                pass
+
+        self.assertEqual(['apply_mask', 'normalize', 'aggregate'], [span['name'] for span in ref.spans])
+        self.assertEqual(['session', 'other', 'session'], [span['node'] for span in ref.spans])
+        self.assertEqual([100, 0, 100], [span['bytes_read'] for span in ref.spans])
+
+        report = ref.get_report()
+        self.assertEqual(1, report['session']['apply_mask']['calls'])
+        self.assertIn('apply_mask', ref.format_report())
+
+    def test_peak_memory(self):
+        ref = Profiler()
+        ref.sample_interval = 0.001
+        memory = [100]
+
+        with mock.patch('src.instrumentation.get_memory', side_effect=lambda: memory[0]):
+            with ref.span('aggregate', 'session'):
+                memory[0] = 900
+                time.sleep(0.1)
+                memory[0] = 300
+            memory[0] = 200
+            with ref.span('normalize', 'session'):
+                memory[0] = 250
+
+        # The peak is measured per span and includes memory freed before it ended
+        self.assertEqual([900, 250], [span['peak_memory'] for span in ref.spans])
+        self.assertEqual(900, ref.get_report()['session']['aggregate']['peak_memory'])
+
+    def test_read_sequence(self):
+        profiler.clear()
+        brain = Brain('src/tests/test-data/brain.nii')
+        block = brain.get_block(slice(0, 4), slice(0, 4), slice(0, 2))
+
+        spans = [span for span in profiler.spans if span['name'] == 'read_sequence']
+        self.assertEqual(block.nbytes, spans[0]['bytes_read'])
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'profile.json')
+            profiler.save(path)
+            with open(path, 'r') as f:
+                self.assertEqual(len(profiler.spans), len(json.load(f)['spans']))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_tree_paths(self):
+        configuration = copy.deepcopy(test_batch.TestBatch.configuration)
+        individuals = configuration['groups'][0]['groups']
+        individuals.append(dict(individuals[0], name='other'))
+        individuals.append(dict(individuals[0]))
+        project = create_group(configuration)
+
+        profiler.clear()
+        project.get_mean()
+
+        # Sessions with the same name in different individuals are not merged
+        report = profiler.get_report()
+        for path in ['project/group/individual/session', 'project/group/other/session',
+                     'project/group/individual_3/session']:
+            self.assertEqual(1, report[path]['apply_mask']['calls'])
+        self.assertEqual(1, report['project']['aggregate']['calls'])
+
+        session = project.children[0].children[2].sessions[0]
+        project.children[0].children[2].remove_session(session)
+        self.assertEqual('session', session.get_tree_path())
+
+
+if __name__ == '__main__':
+    unittest.main()
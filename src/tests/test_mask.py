@@ -17,7 +17,8 @@
 
 import unittest
 import mock
-from src.mask import Mask
+import numpy as np
+from src.mask import Mask, create_roi
 
 
 class TestMask(unittest.TestCase):
@@ -31,6 +32,45 @@ class TestMask(unittest.TestCase):
         ref = Mask('src/tests/test-data/mask.nii')
         self.assertEqual({'path': 'src/tests/test-data/mask.nii'}, ref.get_configuration())
 
+    def test_load_roi(self):
+        ref = Mask('src/tests/test-data/mask.nii')
+        data = ref.data
+
+        self.assertEqual(np.int32, ref.indices.dtype)
+        self.assertEqual(np.count_nonzero(data), ref.count)
+        self.assertTrue(np.array_equal(np.nonzero(data), ref.get_coordinates()))
+        self.assertTrue(np.array_equal(data[np.nonzero(data)], ref.weights))
+
+        box = ref.bounding_box
+        self.assertEqual(ref.count, np.count_nonzero(data[box]))
+
+    def test_get_index_of_roi(self):
+        ref = Mask('src/tests/test-data/mask.nii')
+        data = np.zeros(ref.shape)
+        data[3:6, 10, 1:3] = 1
+        data[4, 11:20, 2] = 1
+        ref.mask_file = mock.Mock(dataobj=data, shape=data.shape)
+
+        self.assertTrue(np.array_equal([[4, 10, 2]], ref.get_index_of_roi()))
+        self.assertTrue(np.allclose(np.mean(np.nonzero(data), axis=1), ref.get_centroid()))
+
+    def test_create_roi(self):
+        size = (12, 10, 8)
+        coordinate = (5, 4, 3)
+        x, y, z = np.indices(size)
+
+        sphere = create_roi(size, "Sphere", coordinate, (3, 2, 1))
+        expected = ((x - 5) / 3.0) ** 2 + ((y - 4) / 2.0) ** 2 + ((z - 3) / 1.0) ** 2 <= 1
+        self.assertTrue(np.array_equal(expected, sphere))
+
+        box = create_roi(size, "Box", coordinate, (2, 1, 0))
+        expected = (abs(x - 5) <= 2) & (abs(y - 4) <= 1) & (z == 3)
+        self.assertTrue(np.array_equal(expected, box))
+
+        # The ROI is cut at the edges of the volume
+        sphere = create_roi(size, "Sphere", (0, 0, 0), (2, 2, 2))
+        self.assertEqual(np.count_nonzero(sphere), np.count_nonzero(x ** 2 + y ** 2 + z ** 2 <= 4))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
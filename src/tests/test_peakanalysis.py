@@ -0,0 +1,94 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+import numpy as np
+from src.group import Group
+from src.peakanalysis import analyze_curves
+
+
+class TestPeakAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.linspace(-2, 10, 121)
+
+    def test_gaussian(self):
+        # Gaussians with sigma 1 peaking at 4 and 5.05, between two samples
+        curves = np.vstack([3 * np.exp(-(self.x - 4) ** 2 / 2),
+                            np.exp(-(self.x - 5.05) ** 2 / 2)])
+        analysis = analyze_curves(self.x, curves)
+
+        self.assertTrue(np.all(analysis['valid']))
+        self.assertTrue(np.allclose([4, 5.05], analysis['peak_time'], atol=1e-3))
+        # The rise from 10 % of a Gaussian to its peak takes sqrt(2 * ln(10)) * sigma
+        self.assertTrue(np.allclose(analysis['peak_time'] - analysis['onset_latency'],
+                                    analysis['time_to_peak']))
+        self.assertTrue(np.allclose(np.sqrt(2 * np.log(10)), analysis['time_to_peak'], atol=0.02))
+        self.assertTrue(np.allclose([3, 1], analysis['peak_value'], rtol=1e-3))
+        self.assertTrue(np.allclose(curves[:, 20], analysis['onset_value']))
+        self.assertTrue(np.allclose(analysis['peak_value'] - analysis['onset_value'],
+                                    analysis['amplitude']))
+
+        # The FWHM of a Gaussian is 2 * sqrt(2 * ln(2)) * sigma
+        width = analysis['fwhm_end'] - analysis['fwhm_start']
+        self.assertTrue(np.allclose(2 * np.sqrt(2 * np.log(2)), width, atol=0.02))
+        self.assertTrue(np.all(analysis['fwhm_start'] < analysis['peak_time']))
+        self.assertTrue(np.all(analysis['onset_latency'] < analysis['fwhm_start']))
+
+    def test_no_peak(self):
+        analysis = analyze_curves(self.x, [self.x, -self.x])
+        self.assertFalse(np.any(analysis['valid']))
+
+    def test_missing_crossing(self):
+        # The curve never falls back to half of its amplitude after the peak
+        curve = np.where(self.x < 4, self.x, 4 - 0.1 * (self.x - 4))
+        analysis = analyze_curves(self.x, curve)
+
+        self.assertTrue(analysis['valid'][0])
+        self.assertTrue(np.isclose(2, analysis['fwhm_start'][0], atol=0.05))
+        self.assertTrue(np.isnan(analysis['fwhm_end'][0]))
+
+    def test_response_properties(self):
+        ref = Group()
+        ref.x_axis = self.x
+        curves = {'60': 3 * np.exp(-(self.x - 4) ** 2 / 2),
+                  '200': np.exp(-(self.x - 6) ** 2 / 2)}
+
+        with mock.patch.object(Group, 'get_mean', return_value=curves):
+            ref.smoothing_method = 'whittaker'
+            properties = ref.get_response_properties(0.01)
+            self.assertIs(properties, ref.get_response_properties(0.01))
+            self.assertTrue(np.isclose(6, properties['200']['peak'][0], atol=0.01))
+            self.assertTrue(np.isclose(np.sqrt(2 * np.log(10)), properties['200']['time_to_peak'],
+                                       atol=0.05))
+
+            fwhm = ref.get_fwhm('All', 0.01)
+            self.assertEqual(properties['60']['fwhm'], fwhm['60'])
+            self.assertEqual({'200': properties['200']['fwhm']}, ref.get_fwhm('200', 0.01))
+            self.assertEqual(properties['60']['peak'], ref.get_peaks(0.01, smooth=True)['60'])
+
+            self.assertIsNot(properties, ref.get_response_properties(1))
+
+        with mock.patch.object(Group, 'get_mean', return_value={'1': self.x}):
+            ref.smoothed_responses = None
+            self.assertRaises(Exception, ref.get_response_properties, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
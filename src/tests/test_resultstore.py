@@ -0,0 +1,69 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from src.batch import create_group
+from src.resultstore import H5PY_AVAILABLE, ResultsReader, save_results
+from src.tests import test_batch
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.project = create_group(test_batch.TestBatch.configuration)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, path):
+        nodes = save_results(path, [self.project])
+
+        session = self.project.children[0].children[0].sessions[0]
+        with ResultsReader(path) as reader:
+            self.assertEqual(nodes, reader.get_nodes())
+            self.assertEqual(['project', 'project/group', 'project/group/individual',
+                              'project/group/individual/session'], nodes)
+
+            node = 'project/group/individual/session'
+            self.assertEqual('session', reader.get_attributes(node)['name'])
+            self.assertEqual(sorted(session.mean_responses.keys()),
+                             reader.get_stimuli_types(node))
+
+            self.assertTrue(np.array_equal(session.responses['60'],
+                                           reader.read(node, 'responses', '60')))
+            means = reader.read(node, 'mean')
+            for stimuli_type, mean in session.mean_responses.iteritems():
+                self.assertTrue(np.allclose(mean, means[stimuli_type]))
+            self.assertEqual(2, reader.read(node, 'peaks', '60').size)
+            self.assertEqual(means['60'].size, reader.read(node, 'x_axis').size)
+
+    def test_npz(self):
+        self.check_store(os.path.join(self.directory, 'results.npz'))
+
+    @unittest.skipUnless(H5PY_AVAILABLE, 'h5py is not installed')
+    def test_hdf5(self):
+        self.check_store(os.path.join(self.directory, 'results.h5'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,12 @@
 
 import unittest
 import mock
+import nibabel as nib
+import numpy as np
+import scipy.io
+from src.brain import Brain
+from src.mask import Mask
+from src.group import Group
 from src.session import Session
 
 
@@ -52,6 +58,159 @@ class TestSession(unittest.TestCase):
         self.assertFalse(ref.settings_changed(False, False, None, None))
         self.assertTrue(ref.settings_changed(True, False, None, None))
 
+    def test_apply_mask(self):
+        ref = Session()
+        ref.load_sequence('src/tests/test-data/brain.nii')
+        ref.load_mask('src/tests/test-data/mask.nii')
+        ref.apply_mask(ref.mask)
+
+        expected = scipy.io.loadmat('src/tests/test-data/expectedMaskApplied.mat')['maskApplied']
+
+        self.assertEqual(expected.shape, ref.masked_data.shape)
+        self.assertTrue(np.allclose(expected, ref.masked_data))
+
+    def test_apply_masks(self):
+        ref = Session()
+        ref.tr = 0.5
+        ref.load_sequence('src/tests/test-data/brain.nii')
+        ref.load_stimuli('src/tests/test-data/stimuli.mat')
+
+        atlas_data = np.zeros((32, 32, 5))
+        atlas_data[2:5, 3:9, 1] = 1
+        atlas_data[20:30, 10:12, 2:4] = 2
+        atlas = Mask('src/tests/test-data/mask.nii')
+        atlas.mask_file = nib.Nifti1Image(atlas_data, np.eye(4))
+
+        masks = atlas.get_labels()
+        masked_data = ref.apply_masks(masks)
+
+        self.assertEqual([1, 2], [mask.label for mask in masks])
+        self.assertEqual((2, 20), masked_data.shape)
+        for row, mask in enumerate(masks):
+            voxels = ref.brain.sequence[atlas_data == mask.label]
+            expected = np.sum(voxels, axis=0) / np.count_nonzero(voxels, axis=0)
+            self.assertTrue(np.allclose(expected, masked_data[row]))
+
+        # The sequence is read in chunks of images when the block is large
+        with mock.patch.object(Brain, 'slab_size', 1):
+            with mock.patch.object(Brain, 'get_block', autospec=True,
+                                   side_effect=Brain.get_block) as get_block:
+                self.assertTrue(np.allclose(masked_data, ref.apply_masks(masks)))
+        self.assertEqual(20, get_block.call_count)
+
+        roi_responses = ref.calculate_roi_responses(masks, False, False)
+        self.assertEqual(2, len(roi_responses))
+        self.assertEqual(sorted(['60', '200', '130', '70', '40']), sorted(roi_responses[1].keys()))
+        self.assertEqual({}, ref.responses)
+
+    def test_separate_into_responses(self):
+        ref = Session()
+        ref.tr = 0.5
+        ref.load_stimuli('src/tests/test-data/stimuli.mat')
+        ref.masked_data = np.arange(20, dtype=float).reshape((1, 20))
+
+        # The onsets are at images 2, 6, 10, 14, 18 and 20
+        ref.separate_into_responses(ref.stimuli)
+
+        self.assertTrue(np.allclose(ref.x_axis, [0, 0.5]))
+        self.assertTrue(np.allclose(ref.responses['60'], [[1, 2]]))
+        self.assertTrue(np.allclose(ref.responses['40'], [[17, 18]]))
+
+        # The first response does not fit with two images before the onset
+        ref.stimuli.baseline = 2
+        ref.separate_into_responses(ref.stimuli)
+
+        self.assertTrue(np.allclose(ref.x_axis, [-1, -0.5, 0, 0.5]))
+        self.assertNotIn('60', ref.responses)
+        self.assertTrue(np.allclose(ref.responses['200'], [[3, 4, 5, 6]]))
+        self.assertEqual(len(ref.responses), 4)
+
+        # The onsets fall on whole images, so interpolation changes nothing
+        ref.stimuli.baseline = 0
+        ref.stimuli.interpolate = True
+        ref.separate_into_responses(ref.stimuli)
+
+        self.assertTrue(np.allclose(ref.responses['60'], [[1, 2]]))
+
+        # Move the onsets half an image later
+        ref.stimuli.onset_times = ref.stimuli.onset_times + 0.25
+        ref.separate_into_responses(ref.stimuli)
+
+        self.assertTrue(np.allclose(ref.responses['60'], [[1.5, 2.5]]))
+        self.assertTrue(np.allclose(ref.responses['40'], [[17.5, 18.5]]))
+
+    def test_lazy_loading(self):
+        configuration = {'path': 'src/tests/test-data/brain.nii',
+                         'mask': {'path': 'src/tests/test-data/mask.nii'},
+                         'stimuli': {'path': 'src/tests/test-data/stimuli.mat', 'tr': 0.5,
+                                     'baseline': 2},
+                         'name': 'test',
+                         'tr': 0.5}
+
+        with mock.patch('src.session.Brain') as mock_brain:
+            ref = Session(configuration)
+
+            # No image is opened until it is used
+            self.assertTrue(ref.ready_for_calculation())
+            self.assertEqual(ref.get_configuration(), configuration)
+            self.assertEqual(ref.get_path('brain'), 'src/tests/test-data/brain.nii')
+            self.assertFalse(mock_brain.called)
+
+        self.assertEqual(ref.brain.path, 'src/tests/test-data/brain.nii')
+        self.assertEqual(ref.stimuli.baseline, 2)
+        self.assertEqual(ref.stimuli.tr, 0.5)
+        # The mask is compared with the sequence by its header only
+        self.assertEqual(['mask'], list(ref.pending))
+        self.assertEqual(ref.get_configuration(), configuration)
+
+        # Replacing a file that has not been opened yet skips opening it
+        ref = Session(configuration)
+        ref.mask = None
+        self.assertNotIn('mask', ref.pending)
+        self.assertIn('brain', ref.pending)
+        self.assertNotIn('mask', ref.get_configuration())
+
+    def test_missing_sequence(self):
+        configuration = {'path': 'src/tests/test-data/missing.nii',
+                         'mask': {'path': 'src/tests/test-data/mask.nii'},
+                         'stimuli': {'path': 'src/tests/test-data/stimuli.mat', 'tr': 0.5},
+                         'tr': 0.5}
+        ref = Session(configuration)
+        self.assertFalse(ref.ready_for_calculation())
+        # The path is still saved although the sequence can not be opened
+        self.assertEqual(ref.get_path('brain'), 'src/tests/test-data/missing.nii')
+
+        # A group skips the session instead of failing
+        group = Group()
+        group.add_session(ref)
+        group.add_session(Session(dict(configuration, path='src/tests/test-data/brain.nii')))
+        self.assertTrue(group.ready_for_calculation())
+        self.assertEqual(1, len(group.get_sessions()))
+        mean = group.get_mean(False, False)
+        self.assertTrue(mean)
+        self.assertIsNone(ref.brain)
+        # The sequence is still saved after it failed to open
+        self.assertEqual(ref.get_configuration(), configuration)
+
+    def test_stimuli_too_long(self):
+        configuration = {'path': 'src/tests/test-data/brain.nii',
+                         'stimuli': {'path': 'src/tests/test-data/stimuli.mat', 'tr': 0.5},
+                         'tr': 0.5}
+        ref = Session(configuration)
+
+        # The stimuli runs past the end of the sequence
+        with mock.patch('src.group.Stimuli') as mock_stimuli:
+            mock_stimuli.return_value.data = np.array([[1000, 1]])
+            self.assertFalse(ref.ready_for_calculation())
+            self.assertEqual(ref.get_configuration(), configuration)
+            self.assertIsNone(ref.stimuli)
+            self.assertEqual(ref.get_configuration(), configuration)
+            self.assertFalse(ref.ready_for_calculation())
+
+        # Setting another file replaces the one that could not be opened
+        ref.stimuli = None
+        self.assertNotIn('stimuli', ref.get_configuration())
+
     @unittest.skip('Not finished')
     def test_load_config(self):
         # Crash if session has no name in config
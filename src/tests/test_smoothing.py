@@ -0,0 +1,112 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+import numpy as np
+from scipy.interpolate import UnivariateSpline
+from src.group import Group
+from src.smoothing import get_smoothing_factor, get_whittaker_operator, smooth_curves
+
+
+class TestSmoothing(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.arange(20, dtype=float)
+        random = np.random.RandomState(0)
+        self.curves = {'60': np.sin(self.x / 4) + random.normal(0, 0.1, 20),
+                       '200': 2 * np.sin(self.x / 4) + random.normal(0, 0.1, 20)}
+
+    def test_spline(self):
+        smoothed, splines = smooth_curves(self.x, self.curves, 2)
+
+        for key, curve in self.curves.iteritems():
+            expected = UnivariateSpline(self.x, curve, k=4, s=2)(self.x)
+            self.assertTrue(np.allclose(expected, smoothed[key]))
+            self.assertTrue(np.allclose(expected, splines[key](self.x)))
+
+    def test_whittaker(self):
+        smoothed, splines = smooth_curves(self.x, self.curves, 5, method='whittaker')
+        self.assertIsNone(splines)
+
+        operator = get_whittaker_operator(20, 5)
+        for key, curve in self.curves.iteritems():
+            self.assertTrue(np.allclose(operator.dot(curve), smoothed[key]))
+            # The smoothed curve is closer to the curve without noise
+            self.assertLess(np.sum((smoothed[key] - curve) ** 2), np.sum(curve ** 2))
+
+        # Straight lines are not changed
+        line, _ = smooth_curves(self.x, {'1': 3 * self.x + 1}, 100, method='whittaker')
+        self.assertTrue(np.allclose(3 * self.x + 1, line['1']))
+
+        self.assertRaises(Exception, smooth_curves, self.x[0:4], {'1': self.x[0:4]}, 1, 'whittaker')
+
+    def test_get_smooth(self):
+        ref = Group()
+        ref.x_axis = self.x
+
+        with mock.patch.object(Group, 'get_mean', return_value=self.curves) as mock_mean:
+            smoothed = ref.get_smooth(2)
+            self.assertIs(smoothed, ref.get_smooth(2))
+            self.assertEqual(1, mock_mean.call_count)
+            self.assertIsNot(smoothed, ref.get_smooth(3))
+
+            ref.smoothing_method = 'whittaker'
+            ref.smoothed_responses = None
+            smoothed = ref.get_smooth(5)
+            splines = ref.get_smooth(5, splice=True)
+            self.assertTrue(np.allclose(smoothed['60'], splines['60'](self.x)))
+
+            peaks = ref.get_peaks(5, smooth=True)
+            self.assertTrue(np.isclose(np.max(smoothed['200']), peaks['200'][1], rtol=1e-2))
+
+    def test_smoothing_method(self):
+        ref = Group()
+        ref.x_axis = self.x
+        self.assertEqual('spline', ref.get_smoothing_method())
+        self.assertEqual(20, get_smoothing_factor(ref))
+        ref.plot_settings['percent'] = True
+        self.assertEqual(2, get_smoothing_factor(ref))
+
+        # The method saved for the node has its own default factor
+        ref.plot_settings['smoothing_method'] = 'whittaker'
+        self.assertEqual('whittaker', ref.get_smoothing_method())
+        self.assertEqual(10, get_smoothing_factor(ref))
+        self.assertEqual(5, get_smoothing_factor(ref, 5))
+
+        # The factor last used in the plot window is saved per method
+        ref.plot_settings['smoothing_factors'] = {'whittaker': 3}
+        self.assertEqual(3, get_smoothing_factor(ref))
+        ref.plot_settings['smoothing_method'] = 'spline'
+        self.assertEqual(2, get_smoothing_factor(ref))
+        ref.plot_settings['smoothing_method'] = 'whittaker'
+
+        with mock.patch.object(Group, 'get_mean', return_value=self.curves):
+            smoothed = ref.get_smooth(2)
+            operator = get_whittaker_operator(20, 2)
+            self.assertTrue(np.allclose(operator.dot(self.curves['60']), smoothed['60']))
+
+            # Changing the method smooths the curves again
+            with mock.patch.object(Group, 'smoothing_method', 'spline'):
+                self.assertEqual('spline', ref.get_smoothing_method())
+                spline = UnivariateSpline(self.x, self.curves['60'], k=4, s=2)(self.x)
+                self.assertTrue(np.allclose(spline, ref.get_smooth(2)['60']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,7 @@
 
 import unittest
 import mock
+import numpy as np
 import scipy.io
 from src.stimuli import Stimuli
 
@@ -35,6 +36,18 @@ class TestStimuli(unittest.TestCase):
                     'tr': 0.5}
         self.assertEqual(expected, ref.get_configuration())
 
+    def test_data(self):
+        ref = Stimuli('src/tests/test-data/stimuli.mat', 0.5)
+
+        self.assertEqual(np.int32, ref.data.dtype)
+        self.assertTrue(np.array_equal([2, 6, 10, 14, 18, 20], ref.data[:, 0]))
+        self.assertTrue(np.array_equal([60, 200, 130, 70, 40, 100], ref.data[:, 1]))
+        self.assertIs(ref.data, ref.data)
+
+        ref.tr = 2
+        self.assertTrue(np.array_equal([0, 1, 2, 3, 4, 5], ref.data[:, 0]))
+        self.assertEqual(np.float64, ref.onset_times.dtype)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
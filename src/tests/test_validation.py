@@ -0,0 +1,56 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from src.validation import get_nodes, validate_configuration
+
+
+class TestValidation(unittest.TestCase):
+
+    def create_configuration(self, session):
+        return {'project': [{'name': 'project',
+                             'groups': [{'name': 'group',
+                                         'groups': [{'name': 'individual',
+                                                     'sessions': [session]}]}]}]}
+
+    def test_get_nodes(self):
+        configuration = self.create_configuration({'name': 'session'})
+
+        names = [node['name'] for node in get_nodes(configuration)]
+        self.assertEqual(['project', 'group', 'individual', 'session'], names)
+
+    def test_validate_configuration(self):
+        session = {'name': 'session',
+                   'path': 'src/tests/test-data/brain.nii',
+                   'mask': {'path': 'src/tests/test-data/mask.nii'},
+                   'stimuli': {'path': 'src/tests/test-data/stimuli.mat', 'tr': 0.5},
+                   'tr': 0.5}
+        self.assertEqual([], validate_configuration(self.create_configuration(session)))
+
+        session['anatomy_path'] = 'src/tests/test-data/brain.nii'
+        session['mask'] = {'path': 'src/tests/test-data/missing.nii'}
+        session['tr'] = 0.1
+
+        messages = validate_configuration(self.create_configuration(session))
+        self.assertEqual(3, len(messages))
+        self.assertIn('4 dimensions instead of 3', messages[0])
+        self.assertIn('missing.nii does not exist', messages[1])
+        self.assertIn('too long', messages[2])
+        self.assertTrue(all(message.startswith('session: ') for message in messages))
+
+if __name__ == '__main__':
+    unittest.main()
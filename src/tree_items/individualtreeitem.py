@@ -49,8 +49,8 @@ class IndividualTreeItem(QTreeWidgetItem, Group):
 
     def remove_item(self):
         remove = None
-        if len(self.sessions) > 0 or self.description != "" or self.mask is not None or self.stimuli is not None or\
-                self.anatomy is not None or self.plot_settings != {}:
+        if len(self.sessions) > 0 or self.description != "" or self.has_file('mask') or self.has_file('stimuli') or\
+                self.has_file('anatomy') or self.plot_settings != {}:
             remove = QMessageBox.question(None, "Remove", "Are you sure you want to remove this?",
                                           QMessageBox.Yes | QMessageBox.No)
         if remove == QMessageBox.No:
@@ -92,18 +92,18 @@ class IndividualTreeItem(QTreeWidgetItem, Group):
         top_tree_items = []
         for session in self.sessions:
             tree_item = QTreeWidgetItem([session.name])
-            if session.brain:
-                epi_path_item = QTreeWidgetItem(['EPI: ' + session.brain.path.split('/')[-1]])
+            if session.has_file('brain'):
+                epi_path_item = QTreeWidgetItem(['EPI: ' + session.get_path('brain').split('/')[-1]])
             else:
                 epi_path_item = QTreeWidgetItem(['EPI: None'])
 
-            if session.mask:
-                mask_path_item = QTreeWidgetItem(['Mask: ' + session.mask.path.split('/')[-1]])
+            if session.has_file('mask'):
+                mask_path_item = QTreeWidgetItem(['Mask: ' + session.get_path('mask').split('/')[-1]])
             else:
                 mask_path_item = QTreeWidgetItem(['Mask: None'])
 
-            if session.stimuli:
-                stim_path_item = QTreeWidgetItem(['Stimuli: ' + session.stimuli.path.split('/')[-1]])
+            if session.has_file('stimuli'):
+                stim_path_item = QTreeWidgetItem(['Stimuli: ' + session.get_path('stimuli').split('/')[-1]])
             else:
                 stim_path_item = QTreeWidgetItem(['Stimuli: None'])
 
@@ -31,8 +31,8 @@ class SessionTreeItem(QTreeWidgetItem, Session):
 
     def remove_item(self):
         remove = None
-        if  self.description != "" or self.mask is not None or self.stimuli is not None or self.anatomy is not None or\
-                self.brain is not None or self.plot_settings != {}:
+        if  self.description != "" or self.has_file('mask') or self.has_file('stimuli') or self.has_file('anatomy') or\
+                self.has_file('brain') or self.plot_settings != {}:
             remove = QMessageBox.question(None, "Remove", "Are you sure you want to remove this?",
                                           QMessageBox.Yes | QMessageBox.No)
         if remove == QMessageBox.No:
@@ -0,0 +1,145 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Validation of the files of a configuration without loading them.
+
+The files of every project, group, individual and session are checked in
+the same way as when they are added in the main window, but only their
+headers are read, and the nodes are checked in a pool of threads since
+most of the time is spent waiting for the disk.
+"""
+
+import os
+from multiprocessing.pool import ThreadPool
+
+from headers import read_header
+from stimuli import Stimuli
+
+
+def get_nodes(configuration):
+    """
+    Return the configuration of every node in a configuration file.
+
+    :param configuration: Configuration with a list of projects, or the
+                          configuration of a single node.
+    :return: A list with the configuration of every node.
+    """
+    nodes = []
+    for project in configuration.get('project', []):
+        nodes += get_nodes(project)
+
+    if 'project' not in configuration:
+        nodes.append(configuration)
+        for child in configuration.get('groups', []) + configuration.get('sessions', []):
+            nodes += get_nodes(child)
+
+    return nodes
+
+
+def get_shape(path, name, dimensions, messages):
+    """
+    Read the shape of an image from its cached header, see `headers.read_header`.
+
+    :param name: Name of the file used in the messages.
+    :param dimensions: Number of dimensions the image should have.
+    :param messages: List the problems with the file are added to.
+    :return: The shape of the image, or None if there was a problem.
+    """
+    try:
+        shape = read_header(path).shape
+    except IOError:
+        messages.append(path + " does not exist")
+        return None
+    except Exception:
+        messages.append(path + " could not be opened. It might be corrupted")
+        return None
+
+    if len(shape) != dimensions:
+        messages.append("The " + name + " " + path + " has " + str(len(shape)) +
+                        " dimensions instead of " + str(dimensions))
+        return None
+
+    return shape
+
+
+def validate_node(configuration):
+    """
+    Check the files of a single node.
+
+    :param configuration: Configuration of a project, group, individual or session.
+    :return: A list of messages describing the problems that were found.
+    """
+    messages = []
+
+    brain_shape = None
+    if 'path' in configuration:
+        brain_shape = get_shape(configuration['path'], "EPI sequence", 4, messages)
+
+    if 'anatomy_path' in configuration:
+        get_shape(configuration['anatomy_path'], "anatomy", 3, messages)
+
+    if 'mask' in configuration:
+        mask_shape = get_shape(configuration['mask']['path'], "mask", 3, messages)
+        if brain_shape and mask_shape and brain_shape[0:3] != mask_shape:
+            messages.append("The mask " + configuration['mask']['path'] +
+                            " is not the same size as the EPI sequence " + configuration['path'])
+
+    if 'stimuli' in configuration:
+        path = configuration['stimuli']['path']
+        # The stimuli is opened with the tr of the node, see Group.load_stimuli
+        tr = configuration.get('tr', 1)
+        if not os.path.exists(path):
+            messages.append(path + " does not exist")
+        else:
+            try:
+                stimuli = Stimuli(path, tr)
+            except Exception:
+                messages.append(path + " is not a proper stimuli file. It might be corrupted or "
+                                "in the wrong format")
+            else:
+                if brain_shape and stimuli.data[-1, 0] > brain_shape[3]:
+                    messages.append("The times in the stimuli file " + path + " are too long "
+                                    "compared to the length of the EPI sequence " +
+                                    configuration['path'])
+
+    if messages and configuration.get('name'):
+        messages = [configuration['name'] + ": " + message for message in messages]
+
+    return messages
+
+
+def validate_configuration(configuration, workers=8):
+    """
+    Check the files of every node in a configuration.
+
+    :param configuration: Configuration as saved by the main window.
+    :param workers: Number of threads the nodes are checked in.
+    :return: A list of messages describing the problems that were found.
+    """
+    nodes = get_nodes(configuration)
+    if not nodes:
+        return []
+
+    pool = ThreadPool(min(workers, len(nodes)))
+    try:
+        results = pool.map(validate_node, nodes)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [message for messages in results for message in messages]
@@ -0,0 +1,41 @@
+# Copyright (C) 2016 pfechd
+#
+# This file is part of JABE.
+#
+# JABE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JABE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JABE.  If not, see <http://www.gnu.org/licenses/>.
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from validation import validate_configuration
+
+
+class ValidationThread(QThread):
+    """
+    Thread which checks the files of a configuration after it has been
+    loaded, so that the tree is shown before the files have been read.
+    """
+
+    # Emitted with the problems that were found, which may be none
+    validated = pyqtSignal(list)
+
+    def __init__(self, configuration, parent=None):
+        """
+        :param configuration: Configuration as saved by the main window.
+        :param parent: Parent object of the thread.
+        """
+        super(ValidationThread, self).__init__(parent)
+        self.configuration = configuration
+
+    def run(self):
+        self.validated.emit(validate_configuration(self.configuration))